@@ -1,49 +1,91 @@
+from __future__ import annotations
+
 import datetime as dt
 from pathlib import Path
-from typing import Dict, List, Literal, Optional
+from typing import TYPE_CHECKING, Dict, List, Literal, Optional, Tuple
 
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import streamlit as st
-from plotly.subplots import make_subplots
 
-from data import get_power_usage, get_smartcloud_data, get_userinfo_detailed
+import data
+
+# pandas and plotly are imported where they are first needed, so the page shell
+# renders before the heavy modules are loaded. See benchmarks/startup.py.
+if TYPE_CHECKING:
+    import pandas as pd
 
 TOKEN_PATH = Path("token.txt")
-LOCAL_DATA_PATH = Path("data.csv")
-MONTH_NAMES = [
-    "",
-    "januar",
-    "februar",
-    "marts",
-    "april",
-    "maj",
-    "juni",
-    "juli",
-    "august",
-    "september",
-    "oktober",
-    "november",
-    "december",
-]
-DAY_NAMES = ["mandag", "tirsdag", "onsdag", "torsdag", "fredag", "lørdag", "søndag"]
+# Historic data next to the app, the first of these files that exists is read
+LOCAL_DATA_PATHS = (Path("data.parquet"), Path("data.arrow"), Path("data.csv"))
+HISTORY_FILE_TYPES = ["parquet", "arrow", "feather", "csv"]
+FETCH_RESOLUTIONS = {"Timer": "PT1H", "Kvarter": "PT15M"}
+FORECAST_HORIZONS = {"De næste 7 dage": 7, "Den næste måned": 30}
 USER_INFO_TEMPLATE = """Adresse: {} {}, {} {}\n\nBruger(e): {} {}"""
 
 
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    from data.fingerprint import fingerprint
+
+    return fingerprint(df)
+
+
+# Cached functions taking the combined frame are keyed by a hash of its content
+HASH_FUNCS = {"pandas.core.frame.DataFrame": frame_fingerprint}
+
+
 @st.cache(show_spinner=False)
 def get_userinfo_cached(*args, **kwargs):
-    return get_userinfo_detailed(*args, **kwargs)
+    return data.get_userinfo_detailed(*args, **kwargs)
 
 
 @st.cache(show_spinner=False)
 def get_smartcloud_data_cached(*args, **kwargs):
-    return get_smartcloud_data(*args, **kwargs)
+    return data.get_smartcloud_data(*args, **kwargs)
 
 
 @st.cache(show_spinner=False)
 def get_power_usage_cached(*args, **kwargs):
-    return get_power_usage(*args, **kwargs)
+    return data.get_power_usage(*args, **kwargs)
+
+
+@st.cache(show_spinner=False, ttl=3600)
+def get_spot_prices_cached(*args, **kwargs):
+    return data.get_spot_prices(*args, **kwargs)
+
+
+def get_prefetch_scheduler():
+    from data.prefetch import get_scheduler
+
+    return get_scheduler()
+
+
+@st.cache(show_spinner=False, allow_output_mutation=True)
+def read_local_data(path: Path, mtime: float) -> pd.DataFrame:
+    # `mtime` is only part of the cache key, so an updated file is read again
+    from data.history import read_history
+
+    return read_history(path)
+
+
+def get_history() -> Optional[pd.DataFrame]:
+    """Historic data uploaded in the session and from a local data file. The
+    uploaded data has precedence where they overlap."""
+    frames = [st.session_state.get("history_df", None)]
+    path = next((path for path in LOCAL_DATA_PATHS if path.exists()), None)
+    if path is not None:
+        from data.history import HistoryError
+
+        try:
+            frames.append(read_local_data(path, path.stat().st_mtime))
+        except HistoryError as error:
+            st.error(f"{path}: {error}")
+
+    frames = [df for df in frames if df is not None]
+    if len(frames) < 2:
+        return frames[0] if frames else None
+
+    from data.history import merge_history
+
+    return merge_history(frames)
 
 
 def display_plotly_chart(
@@ -55,17 +97,12 @@ def display_plotly_chart(
     show_rangeslider: bool = False,
     x_range: List = None,
 ) -> None:
-    px_fun = getattr(px, kind)
-    fig = px_fun(df, y=y, labels=labels, **plot_kwargs)
-    fig.update_layout(
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
-    if show_rangeslider:
-        fig.update_xaxes(rangeslider_visible=True)
-
-    if x_range is not None:
-        fig.update_layout(xaxis_range=x_range)
+    from data.figures import plotly_figure
+    from data.offload import run_figure
 
+    fig = run_figure(
+        plotly_figure, df, y, labels, plot_kwargs, kind, show_rangeslider, x_range
+    )
     st.plotly_chart(fig, use_container_width=True)
 
 
@@ -79,92 +116,74 @@ def display_multiaxes_plotly_chart(
     y2_name: Optional[str] = None,
     kind: Literal["bar", "line"] = "line",
 ):
-    barchart = kind == "bar"
-    kw = {"offsetgroup": 1} if barchart else {}
-    kind = "Bar" if barchart else "Scatter"
-    chart_fun = getattr(go, kind)
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
-    fig.add_trace(
-        chart_fun(x=df.index, y=df[y1], name=y1_name or y1, **kw),
-        secondary_y=False,
-    )
-
-    if barchart:
-        kw["offsetgroup"] = 2
+    from data.figures import multiaxes_plotly_figure
+    from data.offload import run_figure
 
-    fig.add_trace(
-        chart_fun(x=df.index, y=df[y2], name=y2_name or y2, **kw),
-        secondary_y=True,
+    fig = run_figure(
+        multiaxes_plotly_figure, df, y1, y2, y1_axis, y2_axis, y1_name, y2_name, kind
     )
-    # Set x-axis title
-    fig.update_xaxes(title_text="Tid")
+    st.plotly_chart(fig, use_container_width=True)
 
-    # Set y-axes titles
-    fig.update_yaxes(title_text=y1_axis, secondary_y=False)
-    fig.update_yaxes(title_text=y2_axis, secondary_y=True)
 
-    fig.update_layout(
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-        barmode="group" if kind == "Bar" else None,
-    )
-    st.plotly_chart(fig, use_container_width=True)
+# The aggregations run in the process pool of data.offload when it is enabled
 
 
 def display_average_daily_use(
     in_df: pd.DataFrame, year: int, select_columns: List[str]
 ) -> None:
-    df = in_df[in_df.index.year == year].groupby(pd.Grouper(freq="MS")).sum()
-    df = df[select_columns].divide(df.index.days_in_month, axis=0)
+    from data import aggregate
+    from data.offload import run
 
-    df.index = map(lambda x: MONTH_NAMES[x.month] + f" {x.year}", df.index)
-    st.dataframe(df.T)
+    st.dataframe(run(aggregate.get_average_daily_use, in_df, year, select_columns))
 
 
 def get_daily_use(in_df: pd.DataFrame, year: int) -> pd.DataFrame:
-    df = in_df.groupby((in_df.index.floor("d"))).sum()
-    df = df[df.index.year == year]
-    return df
+    from data import aggregate
+    from data.offload import run
+
+    return run(aggregate.get_daily_use, in_df, year)
 
 
 def get_monthly_sum(in_df: pd.DataFrame) -> pd.DataFrame:
-    df = in_df.groupby([pd.Grouper(freq="MS")]).sum()
-    df = df.assign(
-        year=df.index.year,
-        months=pd.Categorical(
-            values=map(lambda x: MONTH_NAMES[x.month], df.index),
-            categories=MONTH_NAMES,
-        ),
-    )
-    return df
+    from data import aggregate
+    from data.offload import run
+
+    return run(aggregate.get_monthly_sum, in_df)
 
 
 def get_weekday_average(
     in_df: pd.DataFrame, year: int, select_columns: List[str]
 ) -> pd.DataFrame:
-    df = in_df.groupby((in_df.index.floor("d"))).sum()
+    from data import aggregate
+    from data.offload import run
 
-    mask = df.index.year == year
-    df = df[mask].groupby((df[mask].index.dayofweek))[select_columns]
-    df = df.mean()
-    df["Ugedag"] = list(map(lambda d: DAY_NAMES[d], df.index))
-    return df
+    return run(aggregate.get_weekday_average, in_df, year, select_columns)
 
 
 def get_hourly_average(in_df: pd.DataFrame, year: int) -> pd.DataFrame:
-    mask = in_df.index.year == year
-    df = in_df[mask].groupby((in_df[mask].index.hour)).mean()
-    df["Timer"] = df.index
-    return df
+    from data import aggregate
+    from data.offload import run
+
+    return run(aggregate.get_hourly_average, in_df, year)
 
 
 def combine_data() -> pd.DataFrame:
+    import pandas as pd
+
+    from data.resolution import infer_resolution, to_resolution
+
     power_df = st.session_state.get("power_df", None)
     smartcloud_df = st.session_state.get("smartcloud_df", None)
 
-    local_df = None
-    if LOCAL_DATA_PATH.exists():
-        with LOCAL_DATA_PATH.open("r") as f:
-            local_df = pd.read_csv(f, parse_dates=True, index_col=[0])
+    # Everything is brought to the resolution of the fetched power data
+    resolution = infer_resolution(power_df) if power_df is not None else None
+    if resolution is not None and smartcloud_df is not None:
+        smartcloud_df = to_resolution(smartcloud_df, resolution)
+
+    local_df = get_history()
+    if local_df is not None:
+        if resolution is not None:
+            local_df = to_resolution(local_df, resolution)
 
         if smartcloud_df is None and power_df is None:
             return local_df
@@ -202,11 +221,52 @@ def combine_data() -> pd.DataFrame:
     return c_df
 
 
+def get_forecast_model(df: pd.DataFrame):
+    from data.forecast import can_update, fit_forecast_model, update_forecast_model
+
+    # The model is kept in the session and only updated with new rows, as long
+    # as the rows it has seen and the resolution are the same
+    model = st.session_state.get("forecast_model", None)
+    if model is None or not can_update(model, df):
+        model = fit_forecast_model(df)
+    else:
+        model = update_forecast_model(model, df)
+
+    st.session_state["forecast_model"] = model
+    return model
+
+
+@st.cache(show_spinner=False, allow_output_mutation=True, hash_funcs=HASH_FUNCS)
+def get_trend_arrays(df: pd.DataFrame, columns: Tuple[str]):
+    from data.trends import build_trend_arrays
+
+    return build_trend_arrays(df, list(columns))
+
+
+@st.cache(show_spinner=False, allow_output_mutation=True, hash_funcs=HASH_FUNCS)
+def get_heat_pump_analysis(df: pd.DataFrame):
+    from data.heatpump import analyse_heat_pump
+
+    return analyse_heat_pump(df)
+
+
+@st.cache(show_spinner=False, allow_output_mutation=True, hash_funcs=HASH_FUNCS)
+def get_day_matrices(df: pd.DataFrame, columns: List[str], periods_per_day: int):
+    from data.load_shift import build_day_matrices
+
+    return build_day_matrices(df, columns, periods_per_day)
+
+
 @st.cache
 def df_to_csv(df):
     return df.to_csv().encode("utf-8")
 
 
+@st.cache(show_spinner=False, hash_funcs=HASH_FUNCS)
+def df_to_parquet(df: pd.DataFrame) -> bytes:
+    return df.to_parquet()
+
+
 def main():
     if TOKEN_PATH.exists():
         with TOKEN_PATH.open("r") as f:
@@ -241,6 +301,11 @@ def main():
                 ("Vest for storebælt", "Øst for storebælt"),
                 index=1,
             )
+            fetch_resolution = form.selectbox(
+                "Tidsopløsning for data-træk",
+                tuple(FETCH_RESOLUTIONS),
+                index=0,
+            )
             do_get_power_data = form.form_submit_button("⚡ Hent el-data!")
 
             if do_get_power_data:
@@ -251,16 +316,31 @@ def main():
                 with st.spinner(
                     f"Trækker eldata fra {str(date_from)} til {str(date_to)}"
                 ):
-                    power_df = get_power_usage_cached(
+                    from data.prefetch import power_account_key
+
+                    scheduler = get_prefetch_scheduler()
+                    account = dict(
                         refresh_token=token_input,
-                        date_from=date_from,
-                        date_to=date_to,
                         dk_west=dk_area == "Vest for storebælt",
+                        resolution=FETCH_RESOLUTIONS[fetch_resolution],
                     )
+                    power_df = scheduler.lookup(
+                        power_account_key(**account), date_from, date_to
+                    )
+                    if power_df is None:
+                        # The account is only kept warm once a fetch with it has
+                        # succeeded, so a wrong token is not retried for days
+                        power_df = get_power_usage_cached(
+                            date_from=date_from, date_to=date_to, **account
+                        )
+                        scheduler.register_power_account(
+                            **account, df=power_df, date_from=date_from, date_to=date_to
+                        )
                     userinfo = get_userinfo_cached(refresh_token=token_input)
 
                     st.session_state["power_df"] = power_df
                     st.session_state["userinfo"] = userinfo
+                    st.session_state["dk_west"] = dk_area == "Vest for storebælt"
 
         with col2:
             form = st.form(key="smartcloud_form")
@@ -276,15 +356,48 @@ def main():
                 with st.spinner(
                     f"Henter varmepumpedata fra {str(date_from)} til {str(date_to)}..."
                 ):
-                    smartcloud_df = get_smartcloud_data_cached(
-                        username=username,
-                        password=password,
-                        date_from=date_from,
-                        date_to=date_to,
+                    from data.prefetch import smartcloud_account_key
+
+                    scheduler = get_prefetch_scheduler()
+                    account = dict(username=username, password=password)
+                    smartcloud_df = scheduler.lookup(
+                        smartcloud_account_key(**account), date_from, date_to
                     )
+                    if smartcloud_df is None:
+                        smartcloud_df = get_smartcloud_data_cached(
+                            date_from=date_from, date_to=date_to, **account
+                        )
+                        scheduler.register_smartcloud_account(
+                            **account,
+                            df=smartcloud_df,
+                            date_from=date_from,
+                            date_to=date_to,
+                        )
                     st.session_state["smartcloud_df"] = smartcloud_df
 
-    c_df = combine_data()
+        st.subheader("Indlæs tidligere data")
+        st.markdown(
+            "Har du gemt dine data tidligere, kan du indlæse dem her. Parquet- og Arrow-filer indlæses hurtigst, men .csv-filer virker også."
+        )
+        upload = st.file_uploader(
+            "Vælg en fil med tidligere data", type=HISTORY_FILE_TYPES
+        )
+        if upload is None:
+            st.session_state.pop("history_df", None)
+            st.session_state.pop("history_upload", None)
+        elif st.session_state.get("history_upload") != (upload.name, upload.size):
+            from data.history import HistoryError, read_history
+
+            # The file stays in the uploader, so it is only read when it changes
+            try:
+                with st.spinner(f"Indlæser {upload.name}..."):
+                    st.session_state["history_df"] = read_history(upload.getbuffer())
+                st.session_state["history_upload"] = (upload.name, upload.size)
+            except HistoryError as error:
+                st.error(str(error))
+
+    with st.spinner("Indlæser data..."):
+        c_df = combine_data()
     if c_df is None:
         st.warning("Du skal hente data ovenfor for at komme videre.")
         return
@@ -314,6 +427,13 @@ def main():
             "text/csv",
             key="download-csv",
         )
+        st.download_button(
+            "👇 Download dine data som .parquet-fil",
+            df_to_parquet(c_df),
+            "data.parquet",
+            "application/octet-stream",
+            key="download-parquet",
+        )
 
     total_use = c_df.groupby(c_df.index.year).sum()
     year = st.selectbox(
@@ -325,7 +445,7 @@ def main():
     heatpump_present: bool = c_df.get("Varmepumpe", None) is not None
     ys = ["Ren el", "Varmepumpe"] if heatpump_present else ["Elforbrug"]
 
-    tab1, tab2 = st.tabs(("💡 Forbrug", "💰 Priser"))
+    tab1, tab2, tab3 = st.tabs(("💡 Forbrug", "💰 Priser", "🔮 Prognose"))
     with tab1:
         st.success(f"Årlig totale forbrug t.d.: {total_use['Elforbrug'][year]} kWh")
 
@@ -378,6 +498,69 @@ def main():
                 kind="bar",
             )
 
+        st.subheader("📈 Tendenser")
+        from data.trends import (
+            TREND_WINDOWS,
+            hour_of_week_frame,
+            trend_frame,
+            year_over_year_frame,
+        )
+
+        trend_columns = ["Elforbrug", *ys] if heatpump_present else ys
+        trends = get_trend_arrays(c_df, tuple(trend_columns))
+
+        col1, col2 = st.columns((0.4, 0.6))
+        with col1:
+            trend_column = st.selectbox("Forbrug", trend_columns, key="trend_column")
+        with col2:
+            windows = st.multiselect(
+                "Glidende gennemsnit (dage)", TREND_WINDOWS, default=[30]
+            )
+        display_plotly_chart(
+            trend_frame(trends, trend_column, year, sorted(windows)),
+            None,
+            {"value": "kWh", "index": "Dato"},
+            kind="line",
+        )
+
+        col1, col2 = st.columns((0.6, 0.4))
+        with col1:
+            compare_years = st.multiselect(
+                "Sammenlign år",
+                list(trends.years),
+                default=[y for y in trends.years if year - 1 <= y <= year],
+            )
+        with col2:
+            compare_window = st.selectbox(
+                "Udjævning (dage)", (1, *TREND_WINDOWS[:2]), index=1
+            )
+        if compare_years:
+            display_plotly_chart(
+                year_over_year_frame(
+                    trends, trend_column, sorted(compare_years), compare_window
+                ),
+                None,
+                {"value": "kWh", "variable": "År"},
+                kind="line",
+            )
+            display_plotly_chart(
+                hour_of_week_frame(trends, trend_column, sorted(compare_years)),
+                None,
+                {"value": "kWh", "variable": "År"},
+                kind="line",
+            )
+
+        if heatpump_present and "Temperatur" in c_df.columns:
+            st.subheader("🌡 Varmepumpe og udetemperatur")
+            analysis = get_heat_pump_analysis(c_df)
+            st.dataframe(analysis.seasons)
+            display_plotly_chart(
+                analysis.curves,
+                list(analysis.curves.columns),
+                {"value": "kWh/t", "Temperatur": "Udetemperatur (°C)"},
+                kind="line",
+            )
+
     with tab2:
         c_df = c_df.assign(
             totalforbrug=c_df["Elforbrug"] * (c_df["SpotPrice"] + c_df["Tarif"])
@@ -419,8 +602,13 @@ def main():
         st.subheader("Gennemsnitsdage og -timer")
         col1, col2 = st.columns([0.5, 0.6])
         with col1:
+            from data.resolution import get_resolution, infer_resolution
+
+            periods_per_day = get_resolution(infer_resolution(c_df)).periods_per_day
             df = get_weekday_average(c_df, year, ["SpotPrice", "Tarif"])
-            df[["SpotPrice", "Tarif"]] = df[["SpotPrice", "Tarif"]].divide(24)
+            df[["SpotPrice", "Tarif"]] = df[["SpotPrice", "Tarif"]].divide(
+                periods_per_day
+            )
 
             display_plotly_chart(
                 df,
@@ -442,6 +630,71 @@ def main():
                 kind="bar",
             )
 
+    with tab3:
+        from data.forecast import forecast
+        from data.resolution import get_resolution, infer_resolution
+
+        horizon = st.selectbox("Prognose for", tuple(FORECAST_HORIZONS))
+        forecast_resolution = get_resolution(infer_resolution(c_df))
+        periods = FORECAST_HORIZONS[horizon] * forecast_resolution.periods_per_day
+
+        # Known spot prices (the next day's are published around 13:00) are
+        # used where available, the rest are estimated from recent prices
+        spot_prices = None
+        if st.session_state.get("dk_west") is not None:
+            from data.prefetch import spot_prices_key
+
+            scheduler = get_prefetch_scheduler()
+            area = dict(
+                dk_west=st.session_state["dk_west"], resolution=infer_resolution(c_df)
+            )
+            first = c_df.index.max() + dt.timedelta(minutes=forecast_resolution.minutes)
+            last = first + dt.timedelta(days=FORECAST_HORIZONS[horizon])
+            # Prices are published for tomorrow at the latest
+            published = min(last.date(), dt.date.today() + dt.timedelta(days=1))
+            spot_df = scheduler.lookup(spot_prices_key(**area), first.date(), published)
+            if spot_df is None:
+                import requests
+
+                # This runs on every rerun, so a failing API must not stop the
+                # page. The forecast then estimates all prices.
+                try:
+                    spot_df = get_spot_prices_cached(
+                        date_from=first.date(), date_to=last.date(), **area
+                    )
+                    scheduler.register_spot_prices(
+                        **area, df=spot_df, date_from=first.date(), date_to=published
+                    )
+                except requests.RequestException:
+                    spot_df = None
+            if spot_df is not None:
+                spot_prices = spot_df["SpotPrice"]
+
+        forecast_df = forecast(
+            get_forecast_model(c_df),
+            c_df,
+            periods,
+            freq=forecast_resolution.freq,
+            spot_prices=spot_prices,
+        )
+
+        st.success(
+            f"Forventet forbrug: {forecast_df['Forventet forbrug'].sum():.0f} kWh "
+            f"til {forecast_df['Forventet pris'].sum():.2f} DKK"
+        )
+        st.info(
+            "Prognosen bygger på dit forbrug på ugens timer og, hvis du har hentet data fra varmepumpen, udetemperaturen.",
+            icon="ℹ",
+        )
+        display_multiaxes_plotly_chart(
+            forecast_df.groupby(forecast_df.index.floor("d")).sum(),
+            "Forventet forbrug",
+            "Forventet pris",
+            "Elforbrug (kWh)",
+            "Pris (DKK)",
+            kind="bar",
+        )
+
     st.subheader("❓ Bruger du strøm på de rigtige tidspunkter?")
 
     label = "Vælg periode"
@@ -449,6 +702,10 @@ def main():
 
     df = c_df[c_df.index.year == year].assign(pris=c_df["SpotPrice"] + c_df["Tarif"])
 
+    import plotly.express as px
+
+    from data.aggregate import MONTH_NAMES
+
     with col1:
         resolution = st.selectbox("Tidsopløsning", ("År", "Måned", "Uge"), index=0)
     with col2:
@@ -465,7 +722,6 @@ def main():
         else:
             sub_df = df
 
-    df = px.data.tips()
     fig = px.histogram(
         sub_df[["pris", "Elforbrug"]],
         x="pris",
@@ -473,6 +729,50 @@ def main():
     )
     st.plotly_chart(fig, use_container_width=True)
 
+    st.subheader("🔀 Hvad hvis du flyttede dit forbrug?")
+    st.markdown(
+        "En del af forbruget flyttes til den billigste time inden for det valgte antal timer før eller efter, samme dag."
+    )
+
+    col1, col2, col3 = st.columns((0.3, 0.35, 0.35), gap="medium")
+    with col1:
+        shift_column = st.selectbox(
+            "Forbrug der flyttes",
+            ("Varmepumpe", "Elforbrug") if heatpump_present else ("Elforbrug",),
+        )
+    with col2:
+        flexible_share = st.slider("Andel der kan flyttes (%)", 0, 100, 20, step=5)
+    with col3:
+        shift_hours = st.slider("Kan flyttes op til (timer)", 0, 12, 6)
+
+    from data.load_shift import simulate_load_shift
+    from data.resolution import get_resolution, infer_resolution
+
+    shift_resolution = get_resolution(infer_resolution(c_df))
+    matrices = get_day_matrices(
+        c_df[c_df.index.year == year], [shift_column], shift_resolution.periods_per_day
+    )
+    result = simulate_load_shift(
+        matrices,
+        flexible_share=flexible_share / 100,
+        window=shift_hours * shift_resolution.periods_per_hour,
+    )
+
+    saving = result.daily["Besparelse"].sum()
+    cost = result.daily["Pris"].sum()
+    st.metric(
+        f"Besparelse i {year}",
+        f"{saving:.2f} DKK",
+        f"{100 * saving / cost if cost else 0:.1f} %",
+    )
+    display_plotly_chart(
+        result.profile,
+        ["Forbrug", "Flyttet forbrug"],
+        {"value": "kWh"},
+        plot_kwargs=dict(barmode="group"),
+        kind="bar",
+    )
+
 
 if __name__ == "__main__":
     main()
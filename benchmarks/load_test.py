@@ -0,0 +1,237 @@
+"""Load test of the Forside page with concurrent simulated sessions.
+
+Every session is a Streamlit AppTest of the page, run in its own thread of this
+process like sessions are in the Streamlit server. The sessions get offline
+stand-in data in place of a fetch, and then go through the page: use the
+controls of the other tabs, change the year and move the load-shifting sliders.
+The latency of every rerun is recorded, along with the CPU use and memory of
+the process and its worker processes, for each number of concurrent sessions.
+
+    python benchmarks/load_test.py --sessions 1 2 4 8 --years 3
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+from streamlit import config
+from streamlit.logger import set_log_level
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import (
+    MemoryCacheStorageManager,
+)
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, app_test, local_script_runner
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGE = ROOT / "0_⚡_Forside.py"
+
+# Make the data package importable by the page, as when running from the root
+sys.path.insert(0, str(ROOT))
+
+
+def share_runtime() -> None:
+    """AppTest sets up a mock Runtime for each run and removes it afterwards, so
+    runs that overlap in threads remove it from under each other. Set up one
+    Runtime for all sessions, as in the server, and keep AppTest off it.
+
+    The server also compiles the page once for all sessions, where AppTest
+    compiles it on every run. Compiling in several threads at once can fail
+    on Python 3.11, so the compiled page is shared too."""
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    app_test.Runtime = SimpleNamespace(_instance=None)
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: script_cache
+    # AppTest also sets this option for each run only
+    config.set_option("global.appTest", True)
+
+
+def stand_in_data(years: int, heatpump: bool, seed: int) -> dict:
+    """Session state like after fetching `years` of hourly data."""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now().floor("d") - pd.Timedelta(hours=1)
+    index = pd.date_range(end - pd.DateOffset(years=years), end, freq="h")
+    hours = np.arange(len(index))
+    temperature = 8 - 10 * np.cos(2 * np.pi * (hours / 24 - 20) / 365.25)
+
+    state = {
+        "power_df": pd.DataFrame(
+            {
+                "Elforbrug": 0.3 + 0.4 * rng.random(len(index)),
+                "Tarif": np.where(np.isin(index.hour, [17, 18, 19, 20]), 1.2, 0.4),
+                "SpotPrice": 1
+                + 0.5 * np.sin(hours / 24 * 2 * np.pi)
+                + 0.3 * rng.random(len(index)),
+            },
+            index=index,
+        )
+    }
+    if heatpump:
+        state["smartcloud_df"] = pd.DataFrame(
+            {
+                "Temperatur": temperature + rng.normal(0, 2, len(index)),
+                "Forbrug": 0.05 * np.maximum(17 - temperature, 0),
+            },
+            index=index,
+        )
+    return state
+
+
+def widget(widgets, label: str):
+    return next(w for w in widgets if w.label == label)
+
+
+def run_session(state: dict, timeout: float, latencies: list, errors: list) -> None:
+    at = AppTest.from_file(str(PAGE), default_timeout=timeout)
+    for key, value in state.items():
+        at.session_state[key] = value
+
+    def rerun(step):
+        start = time.perf_counter()
+        step()
+        latencies.append(time.perf_counter() - start)
+        errors.extend(e.message for e in at.exception)
+
+    # fetch: the first run with the stand-in data
+    rerun(at.run)
+    years = widget(at.selectbox, "Vælg et år").options
+    steps = [
+        # switch tabs: use the controls of the other tabs
+        lambda: widget(at.selectbox, "Tidsopløsning").select("Dag").run(),
+        lambda: widget(at.checkbox, "Data på dagsbasis").check().run(),
+        lambda: widget(at.selectbox, "Prognose for").select_index(1).run(),
+        # change year
+        lambda: widget(at.selectbox, "Vælg et år").select(years[0]).run(),
+        # move slider
+        lambda: widget(at.slider, "Andel der kan flyttes (%)").set_value(60).run(),
+        lambda: widget(at.slider, "Kan flyttes op til (timer)").set_value(3).run(),
+    ]
+    try:
+        for step in steps:
+            rerun(step)
+    except StopIteration:
+        # A widget was not on the page, so the session cannot go on
+        errors.append("missing widget after rerun")
+
+
+def current_rss() -> float:
+    """Resident memory of the process and its worker processes in MB."""
+    pids = ["self"] + [str(child.pid) for child in multiprocessing.active_children()]
+    pages = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                pages += int(f.read().split()[1])
+        except OSError:
+            if pid == "self":
+                return float("nan")
+    return pages * resource.getpagesize() / 2**20
+
+
+def cpu_times() -> dict:
+    """CPU seconds used so far by the process and each of its worker processes,
+    e.g. the pool of `ELOVERSIGT_WORKERS`, by process id."""
+    times = {os.getpid(): time.process_time()}
+    for child in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{child.pid}/stat") as f:
+                # utime and stime, after the command name in parentheses
+                fields = f.read().rsplit(")", 1)[1].split()
+            times[child.pid] = (int(fields[11]) + int(fields[12])) / os.sysconf(
+                "SC_CLK_TCK"
+            )
+        except OSError:
+            pass
+    return times
+
+
+def cpu_used(before: dict, after: dict) -> float:
+    # Workers started during the run count from zero, workers that exited
+    # during it are left out
+    return sum(seconds - before.get(pid, 0.0) for pid, seconds in after.items())
+
+
+def load_test(n_sessions: int, args) -> dict:
+    states = [
+        stand_in_data(args.years, args.heatpump, seed=0 if args.same_data else i)
+        for i in range(n_sessions)
+    ]
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(
+            target=run_session, args=(state, args.timeout, latencies, errors)
+        )
+        for state in states
+    ]
+
+    wall, cpu = time.perf_counter(), cpu_times()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall, cpu = time.perf_counter() - wall, cpu_used(cpu, cpu_times())
+
+    latencies = sorted(latencies)
+    return {
+        "sessions": n_sessions,
+        "reruns": len(latencies),
+        "p50": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "max": latencies[-1],
+        "reruns/s": len(latencies) / wall,
+        "cpu %": 100 * cpu / wall,
+        "rss MB": current_rss(),
+        "peak MB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "errors": len(errors),
+        "first error": errors[0] if errors else "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--years", type=int, default=2, help="years of data")
+    parser.add_argument("--heatpump", action="store_true", help="add heat pump data")
+    parser.add_argument(
+        "--same-data",
+        action="store_true",
+        help="give every session the same data, so they share cached results",
+    )
+    parser.add_argument("--timeout", type=float, default=300, help="per rerun")
+    args = parser.parse_args()
+    share_runtime()
+    # Keep the table readable, the page logs deprecation warnings on every run
+    set_log_level("error")
+
+    header = (
+        "sessions reruns  p50 [s]  p95 [s]  max [s] reruns/s   cpu %  rss MB peak MB"
+    )
+    print(header)
+    for n_sessions in args.sessions:
+        r = load_test(n_sessions, args)
+        print(
+            f"{r['sessions']:8d} {r['reruns']:6d} {r['p50']:8.2f} {r['p95']:8.2f} "
+            f"{r['max']:8.2f} {r['reruns/s']:8.2f} {r['cpu %']:7.0f} "
+            f"{r['rss MB']:7.0f} {r['peak MB']:7.0f}"
+        )
+        if r["errors"]:
+            print(f"         {r['errors']} errors, first: {r['first error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Import-time benchmark for a cold start of the Forside page.
+
+Loads the page module in a fresh interpreter with `python -X importtime` (without
+running `main()`), prints the slowest imports and fails if any of the heavy
+modules are imported before they are needed.
+
+    python benchmarks/startup.py
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGE = ROOT / "0_⚡_Forside.py"
+
+# Modules that must not be imported just by loading the page
+HEAVY_MODULES = ("pandas", "plotly", "requests")
+
+LOAD_PAGE = f"import runpy; runpy.run_path({str(PAGE)!r}, run_name='startup_benchmark')"
+LOAD_STREAMLIT = "import streamlit"
+
+
+def import_times(code: str) -> dict:
+    """Run `code` in a fresh interpreter and return the cumulative import time
+    in microseconds for each imported module. Nested imports keep their
+    indentation, so top-level imports are the names without leading spaces."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name[1:].rstrip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=15, help="imports to show")
+    args = parser.parse_args()
+
+    baseline = import_times(LOAD_STREAMLIT)
+    page = import_times(LOAD_PAGE)
+
+    # Only look at what the page adds on top of streamlit itself
+    seen = {name.strip() for name in baseline}
+    added = {name: us for name, us in page.items() if name.strip() not in seen}
+    total_page = sum(us for name, us in page.items() if not name.startswith(" "))
+    total_added = sum(us for name, us in added.items() if not name.startswith(" "))
+
+    print(f"Page import time:      {total_page / 1000:8.1f} ms")
+    print(f"Added over streamlit:  {total_added / 1000:8.1f} ms\n")
+    for name, us in sorted(added.items(), key=lambda x: -x[1])[: args.top]:
+        print(f"{us / 1000:8.1f} ms  {name.strip()}")
+
+    offenders = sorted(
+        name.strip() for name in added if name.strip().split(".")[0] in HEAVY_MODULES
+    )
+    if offenders:
+        print("\nHeavy modules imported at startup: " + ", ".join(offenders))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
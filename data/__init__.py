@@ -1,2 +1,22 @@
-from .power import get_userinfo_detailed, get_power_usage
-from .smart_cloud import get_smartcloud_data
\ No newline at end of file
+import importlib
+
+# The fetchers pull in pandas and requests, so they are only imported the first
+# time one of them is used. This keeps `import data` cheap on a cold start.
+_LAZY_ATTRIBUTES = {
+    "get_userinfo_detailed": ".power",
+    "get_power_usage": ".power",
+    "get_spot_prices": ".power",
+    "get_smartcloud_data": ".smart_cloud",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
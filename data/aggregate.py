@@ -0,0 +1,74 @@
+"""Aggregations of the combined data shown on the Forside page.
+
+These are plain functions of a frame, so they can run in the page or in a
+worker process of `data.offload`.
+"""
+
+from typing import List
+
+import pandas as pd
+
+from .resolution import to_resolution
+
+MONTH_NAMES = [
+    "",
+    "januar",
+    "februar",
+    "marts",
+    "april",
+    "maj",
+    "juni",
+    "juli",
+    "august",
+    "september",
+    "oktober",
+    "november",
+    "december",
+]
+DAY_NAMES = ["mandag", "tirsdag", "onsdag", "torsdag", "fredag", "lørdag", "søndag"]
+
+
+def get_average_daily_use(
+    in_df: pd.DataFrame, year: int, select_columns: List[str]
+) -> pd.DataFrame:
+    df = in_df[in_df.index.year == year].groupby(pd.Grouper(freq="MS")).sum()
+    df = df[select_columns].divide(df.index.days_in_month, axis=0)
+
+    df.index = map(lambda x: MONTH_NAMES[x.month] + f" {x.year}", df.index)
+    return df.T
+
+
+def get_daily_use(in_df: pd.DataFrame, year: int) -> pd.DataFrame:
+    df = in_df[in_df.index.year == year]
+    df = df.groupby((df.index.floor("d"))).sum()
+    return df
+
+
+def get_monthly_sum(in_df: pd.DataFrame) -> pd.DataFrame:
+    df = in_df.groupby([pd.Grouper(freq="MS")]).sum()
+    df = df.assign(
+        year=df.index.year,
+        months=pd.Categorical(
+            values=map(lambda x: MONTH_NAMES[x.month], df.index),
+            categories=MONTH_NAMES,
+        ),
+    )
+    return df
+
+
+def get_weekday_average(
+    in_df: pd.DataFrame, year: int, select_columns: List[str]
+) -> pd.DataFrame:
+    df = in_df[in_df.index.year == year]
+    df = df.groupby((df.index.floor("d"))).sum()
+    df = df.groupby((df.index.dayofweek))[select_columns].mean()
+    df["Ugedag"] = list(map(lambda d: DAY_NAMES[d], df.index))
+    return df
+
+
+def get_hourly_average(in_df: pd.DataFrame, year: int) -> pd.DataFrame:
+    # Quarter-hour data is summed to whole hours before taking the average
+    df = to_resolution(in_df[in_df.index.year == year], "PT1H")
+    df = df.groupby((df.index.hour)).mean()
+    df["Timer"] = df.index
+    return df
@@ -0,0 +1,83 @@
+"""Plotly figures of the Forside page.
+
+Building a figure, especially with plotly express, is pure Python work, so
+like the aggregations these can run in a worker process of `data.offload`.
+"""
+
+from typing import Callable, Dict, List, Literal, Optional
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+
+def plotly_figure(
+    df: pd.DataFrame,
+    y: List[str],
+    labels: Optional[dict] = None,
+    plot_kwargs: Dict = {},
+    kind: Literal["bar", "line"] = "bar",
+    show_rangeslider: bool = False,
+    x_range: List = None,
+) -> go.Figure:
+    px_fun = getattr(px, kind)
+    fig = px_fun(df, y=y, labels=labels, **plot_kwargs)
+    fig.update_layout(
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    if show_rangeslider:
+        fig.update_xaxes(rangeslider_visible=True)
+
+    if x_range is not None:
+        fig.update_layout(xaxis_range=x_range)
+
+    return fig
+
+
+def multiaxes_plotly_figure(
+    df: pd.DataFrame,
+    y1: str,
+    y2: str,
+    y1_axis: str,
+    y2_axis: str,
+    y1_name: Optional[str] = None,
+    y2_name: Optional[str] = None,
+    kind: Literal["bar", "line"] = "line",
+) -> go.Figure:
+    barchart = kind == "bar"
+    kw = {"offsetgroup": 1} if barchart else {}
+    kind = "Bar" if barchart else "Scatter"
+    chart_fun = getattr(go, kind)
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(
+        chart_fun(x=df.index, y=df[y1], name=y1_name or y1, **kw),
+        secondary_y=False,
+    )
+
+    if barchart:
+        kw["offsetgroup"] = 2
+
+    fig.add_trace(
+        chart_fun(x=df.index, y=df[y2], name=y2_name or y2, **kw),
+        secondary_y=True,
+    )
+    # Set x-axis title
+    fig.update_xaxes(title_text="Tid")
+
+    # Set y-axes titles
+    fig.update_yaxes(title_text=y1_axis, secondary_y=False)
+    fig.update_yaxes(title_text=y2_axis, secondary_y=True)
+
+    fig.update_layout(
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        barmode="group" if kind == "Bar" else None,
+    )
+    return fig
+
+
+def figure_json(
+    df: pd.DataFrame, build: Callable[..., go.Figure], *args, **kwargs
+) -> str:
+    """The figure from `build` serialized, as returned from a worker process."""
+    return build(df, *args, **kwargs).to_json()
@@ -0,0 +1,11 @@
+import hashlib
+
+import pandas as pd
+
+
+def fingerprint(df: pd.DataFrame) -> str:
+    """Content hash of a frame, used as cache key for data derived from it.
+    Hashing is vectorized, so it is cheap compared to what is cached."""
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy())
+    digest.update(",".join(map(str, df.columns)).encode())
+    return digest.hexdigest()
@@ -0,0 +1,200 @@
+"""Forecasting of consumption and cost.
+
+Consumption is modelled as a linear model with one level per hour of the week
+and, when the heat pump temperature is available, a term for the heating
+degrees (degrees below `HEATING_BASE_TEMPERATURE`). The model is kept as the
+sufficient statistics X'X and X'y, so new days are added to the fit without
+going through the history again. It is fitted again when the data it has seen
+changes, or when the time resolution or the use of temperature does. Changes
+are told from a summary of the seen rows (count, sums and missing values),
+which is much cheaper than hashing them on every rerun.
+"""
+
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .resolution import get_resolution, infer_resolution
+
+HOURS_PER_WEEK = 7 * 24
+HEATING_BASE_TEMPERATURE = 17.0
+# Days of recent data used for temperatures and prices in the forecast period
+RECENT_DAYS = 28
+# Minimum number of days with temperatures before the temperature term is used
+MIN_TEMPERATURE_DAYS = 14
+RIDGE = 1e-3
+
+
+class ForecastModel(NamedTuple):
+    column: str
+    resolution: str
+    use_temperature: bool
+    xtx: np.ndarray
+    xty: np.ndarray
+    first_timestamp: pd.Timestamp
+    last_timestamp: pd.Timestamp
+    coefficients: np.ndarray
+    # summary of the data up to `last_timestamp`, see `_seen_summary`
+    seen: Tuple
+
+
+def hour_of_week(index: pd.DatetimeIndex) -> np.ndarray:
+    return (index.dayofweek * 24 + index.hour).to_numpy()
+
+
+def heating_degrees(temperature) -> np.ndarray:
+    return np.maximum(HEATING_BASE_TEMPERATURE - np.asarray(temperature), 0.0)
+
+
+def has_temperature(df: pd.DataFrame) -> bool:
+    """Whether `df` has enough temperatures for the temperature term."""
+    temperature = df.get("Temperatur")
+    periods_per_day = get_resolution(infer_resolution(df)).periods_per_day
+    return (
+        temperature is not None
+        and temperature.notna().sum() >= MIN_TEMPERATURE_DAYS * periods_per_day
+    )
+
+
+def fit_forecast_model(df: pd.DataFrame, column: str = "Elforbrug") -> ForecastModel:
+    """Fit the model to `column` of `df` from scratch."""
+    use_temperature = has_temperature(df)
+    n_features = HOURS_PER_WEEK + use_temperature
+    model = ForecastModel(
+        column=column,
+        resolution=infer_resolution(df),
+        use_temperature=use_temperature,
+        xtx=np.zeros((n_features, n_features)),
+        xty=np.zeros(n_features),
+        first_timestamp=df.index.min(),
+        last_timestamp=df.index.min() - pd.Timedelta(1, "ns"),
+        coefficients=np.zeros(n_features),
+        seen=(),
+    )
+    return update_forecast_model(model, df)
+
+
+def can_update(model: ForecastModel, df: pd.DataFrame) -> bool:
+    """Whether `model` can be updated with the new rows of `df`, or has to be
+    fitted again with `fit_forecast_model`."""
+    return (
+        model.resolution == infer_resolution(df)
+        and model.use_temperature == has_temperature(df)
+        and model.seen == _seen_summary(model, df, model.last_timestamp)
+    )
+
+
+def update_forecast_model(model: ForecastModel, df: pd.DataFrame) -> ForecastModel:
+    """Add the rows of `df` after the last timestamp seen by `model`. The rows
+    up to it must be the ones the model has seen, see `can_update`."""
+    all_df = df
+    df = df[df.index > model.last_timestamp]
+    if df.empty:
+        return model
+
+    y = df[model.column].to_numpy(dtype=float)
+    mask = np.isfinite(y)
+    if model.use_temperature:
+        degrees = heating_degrees(df["Temperatur"].to_numpy(dtype=float))
+        mask &= np.isfinite(degrees)
+        degrees = degrees[mask]
+    how, y = hour_of_week(df.index)[mask], y[mask]
+
+    # X is one-hot in the hour of the week, so X'X is diagonal in that block
+    xtx, xty = model.xtx.copy(), model.xty.copy()
+    hours = np.arange(HOURS_PER_WEEK)
+    xtx[hours, hours] += np.bincount(how, minlength=HOURS_PER_WEEK)
+    xty[:HOURS_PER_WEEK] += np.bincount(how, weights=y, minlength=HOURS_PER_WEEK)
+    if model.use_temperature:
+        degree_sums = np.bincount(how, weights=degrees, minlength=HOURS_PER_WEEK)
+        xtx[:HOURS_PER_WEEK, -1] += degree_sums
+        xtx[-1, :HOURS_PER_WEEK] += degree_sums
+        xtx[-1, -1] += degrees @ degrees
+        xty[-1] += degrees @ y
+
+    coefficients = np.linalg.solve(xtx + RIDGE * np.eye(len(xty)), xty)
+    last_timestamp = df.index.max()
+    return model._replace(
+        xtx=xtx,
+        xty=xty,
+        last_timestamp=last_timestamp,
+        coefficients=coefficients,
+        seen=_seen_summary(model, all_df, last_timestamp),
+    )
+
+
+def _seen_summary(
+    model: ForecastModel, df: pd.DataFrame, last_timestamp: pd.Timestamp
+) -> Tuple:
+    # Replaced or removed rows change the count or the sums, and values that
+    # become missing change the count of missing values
+    columns = [model.column, "Temperatur"] if model.use_temperature else [model.column]
+    mask = df.index <= last_timestamp
+    summary = [int(np.count_nonzero(mask))]
+    for column in columns:
+        values = df[column].to_numpy(dtype=float)[mask]
+        summary += [float(np.nansum(values)), int(np.count_nonzero(np.isnan(values)))]
+    return tuple(summary)
+
+
+def recent_profile(
+    series: pd.Series, index: pd.DatetimeIndex, days: int = RECENT_DAYS
+) -> np.ndarray:
+    """Values for `index` from the average hour of the week over the last `days`
+    of `series`. Hours without recent data get the average of all data."""
+    series = series.dropna()
+    if series.empty:
+        return np.full(len(index), np.nan)
+
+    recent = series[series.index > series.index.max() - pd.Timedelta(days=days)]
+    how = hour_of_week(recent.index)
+    counts = np.bincount(how, minlength=HOURS_PER_WEEK)
+    sums = np.bincount(how, weights=recent.to_numpy(), minlength=HOURS_PER_WEEK)
+
+    with np.errstate(invalid="ignore"):
+        profile = np.where(counts > 0, sums / counts, series.mean())
+    return profile[hour_of_week(index)]
+
+
+def forecast(
+    model: ForecastModel,
+    df: pd.DataFrame,
+    periods: int,
+    freq: str = "60min",
+    spot_prices: Optional[pd.Series] = None,
+) -> pd.DataFrame:
+    """Forecast consumption and cost for `periods` periods after `df`.
+
+    Temperatures, spot prices and tariffs in the forecast period are taken from
+    the recent hours of the week in `df`. Known spot prices, e.g. those for the
+    next day, can be passed in `spot_prices` and are used where available.
+    """
+    index = pd.date_range(
+        df.index.max() + pd.Timedelta(freq), periods=periods, freq=freq
+    )
+
+    consumption = model.coefficients[hour_of_week(index)]
+    if model.use_temperature:
+        temperature = recent_profile(df["Temperatur"], index)
+        consumption = consumption + model.coefficients[-1] * heating_degrees(
+            temperature
+        )
+
+    spot_price = recent_profile(df["SpotPrice"], index)
+    if spot_prices is not None:
+        known = spot_prices[~spot_prices.index.duplicated(keep="last")]
+        known = known.reindex(index).to_numpy()
+        spot_price = np.where(np.isfinite(known), known, spot_price)
+    tarif = recent_profile(df["Tarif"], index)
+
+    consumption = np.maximum(consumption, 0.0)
+    return pd.DataFrame(
+        {
+            "Forventet forbrug": consumption,
+            "SpotPrice": spot_price,
+            "Tarif": tarif,
+            "Forventet pris": consumption * (spot_price + tarif),
+        },
+        index=index,
+    )
@@ -0,0 +1,86 @@
+"""Heat pump consumption against the outdoor temperature.
+
+Everything is computed per heating season (July to June, so a winter is not
+split in two) on hourly NumPy arrays with `np.bincount`, so several winters of
+data are handled in one pass.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .forecast import heating_degrees
+from .resolution import to_resolution
+
+# Edges of the temperature bins of the consumption curves, in degrees
+TEMPERATURE_BINS = np.arange(-16, 28, 2)
+
+
+class HeatPumpAnalysis(NamedTuple):
+    # one row per heating season
+    seasons: pd.DataFrame
+    # average consumption per hour in each temperature bin, one column per season
+    curves: pd.DataFrame
+
+
+def heating_season(index: pd.DatetimeIndex) -> np.ndarray:
+    """The year each heating season starts in, for each timestamp."""
+    return (index.year - (index.month < 7)).to_numpy()
+
+
+def season_label(start_year: int) -> str:
+    return f"{start_year}/{(start_year + 1) % 100:02d}"
+
+
+def analyse_heat_pump(df: pd.DataFrame, column: str = "Varmepumpe") -> HeatPumpAnalysis:
+    """Degree-hours, kWh per heating degree and consumption per temperature bin
+    for each heating season of the hourly `column` and `Temperatur` in `df`."""
+    df = to_resolution(df[[column, "Temperatur"]].dropna(), "PT1H")
+
+    start_years, codes = np.unique(heating_season(df.index), return_inverse=True)
+    seasons = [season_label(year) for year in start_years]
+    n_seasons = len(seasons)
+    consumption = df[column].to_numpy(dtype=float)
+    temperature = df["Temperatur"].to_numpy(dtype=float)
+    degrees = heating_degrees(temperature)
+
+    def per_season(weights=None):
+        return np.bincount(codes, weights=weights, minlength=n_seasons)
+
+    # Least squares fit of consumption = base + slope * degrees, per season
+    n = per_season()
+    sum_x, sum_y = per_season(degrees), per_season(consumption)
+    sum_xx, sum_xy = per_season(degrees * degrees), per_season(degrees * consumption)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x**2)
+        base = (sum_y - slope * sum_x) / n
+
+    season_df = pd.DataFrame(
+        {
+            "Timer": n,
+            "Gradtimer": sum_x,
+            "Forbrug (kWh)": sum_y,
+            "kWh pr. gradtime": slope,
+            "Grundforbrug (kWh/t)": base,
+        },
+        index=pd.Index(seasons, name="Fyringssæson"),
+    )
+
+    # Average consumption per temperature bin and season
+    n_bins = len(TEMPERATURE_BINS) - 1
+    bins = np.clip(np.digitize(temperature, TEMPERATURE_BINS) - 1, 0, n_bins - 1)
+    flat = codes * n_bins + bins
+    counts = np.bincount(flat, minlength=n_seasons * n_bins)
+    sums = np.bincount(flat, weights=consumption, minlength=n_seasons * n_bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        curves = (sums / counts).reshape(n_seasons, n_bins)
+
+    curve_df = pd.DataFrame(
+        curves.T,
+        columns=seasons,
+        index=pd.Index(
+            (TEMPERATURE_BINS[:-1] + TEMPERATURE_BINS[1:]) / 2, name="Temperatur"
+        ),
+    )
+    return HeatPumpAnalysis(season_df, curve_df)
@@ -0,0 +1,100 @@
+"""Import of historic data from Parquet, Arrow IPC or CSV files.
+
+Parquet and Arrow files are read by pyarrow without parsing any text, and
+files on disk are memory-mapped. CSV files, like the one downloaded from the
+app, are parsed by the multithreaded pyarrow CSV reader. The data is checked
+to have a time index and a numeric `Elforbrug` column before it is used.
+"""
+
+from pathlib import Path
+from typing import List, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+REQUIRED_COLUMNS = ("Elforbrug",)
+# Time zone of the fetched data, which has local times without a time zone
+TIMEZONE = "Europe/Copenhagen"
+
+PARQUET_MAGIC = b"PAR1"
+ARROW_FILE_MAGIC = b"ARROW1"
+# Arrow IPC streams start with a continuation marker
+ARROW_STREAM_MAGIC = b"\xff\xff\xff\xff"
+
+
+class HistoryError(Exception):
+    pass
+
+
+def read_history(source: Union[Path, bytes, memoryview]) -> pd.DataFrame:
+    """Historic data from a file, or from the content of an uploaded file. The
+    format is told from the first bytes, anything else is read as CSV."""
+    if isinstance(source, Path):
+        # The table reads straight from the mapped pages of the file
+        f = pa.memory_map(str(source))
+    else:
+        f = pa.BufferReader(source)
+
+    magic = f.read(len(ARROW_FILE_MAGIC))
+    f.seek(0)
+    try:
+        if magic.startswith(PARQUET_MAGIC):
+            table = pq.read_table(f)
+        elif magic.startswith(ARROW_FILE_MAGIC):
+            table = ipc.open_file(f).read_all()
+        elif magic.startswith(ARROW_STREAM_MAGIC):
+            table = ipc.open_stream(f).read_all()
+        else:
+            table = pa_csv.read_csv(f)
+    except pa.ArrowInvalid as error:
+        raise HistoryError(f"Filen kunne ikke læses: {error}") from error
+    return to_history_frame(table)
+
+
+def to_history_frame(table: pa.Table) -> pd.DataFrame:
+    """The table as a frame like the fetched data: a sorted, unique time index
+    without time zone and float columns."""
+    # A column that is empty in every row, e.g. the temperature of a heat pump
+    # without an outdoor sensor, is read from CSV as type null
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(
+                i, field.with_type(pa.float64()), table.column(i).cast(pa.float64())
+            )
+    df = table.to_pandas()
+    if not isinstance(df.index, pd.DatetimeIndex):
+        # Without the index stored by pandas, the first column with times is
+        # used, e.g. the unnamed first column of a CSV file from the app
+        time_columns = [
+            field.name for field in table.schema if pa.types.is_timestamp(field.type)
+        ]
+        if not time_columns:
+            raise HistoryError("Filen har ingen kolonne med tidspunkter")
+        df = df.set_index(time_columns[0])
+
+    if df.index.tz is not None:
+        df.index = df.index.tz_convert(TIMEZONE).tz_localize(None)
+    df.index = df.index.astype("datetime64[ns]").rename(None)
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise HistoryError(f"Filen mangler kolonnen {', '.join(missing)}")
+    not_numeric = [
+        str(column)
+        for column in df.columns
+        if not pd.api.types.is_numeric_dtype(df[column])
+    ]
+    if not_numeric:
+        raise HistoryError(f"Kolonnen {', '.join(not_numeric)} er ikke et tal")
+
+    df = df.astype(float)
+    return df[~df.index.duplicated(keep="last")].sort_index()
+
+
+def merge_history(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """The frames combined, where the first frame with a time has precedence."""
+    df = pd.concat(frames)
+    return df[~df.index.duplicated(keep="first")].sort_index()
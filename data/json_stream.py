@@ -0,0 +1,77 @@
+"""Incremental decoding of large JSON responses.
+
+The API responses we parse are long lists of small records, of which we only
+need a few scalar fields. Instead of materializing the whole document with
+`response.json()`, the raw byte chunks are scanned for `"key": value` pairs of
+the wanted keys, and values are written straight into preallocated arrays.
+"""
+
+import json
+import re
+from typing import Iterable, Iterator, Sequence, Tuple
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 16
+
+_SCALAR = rb'("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)'
+
+
+def iter_values(
+    chunks: Iterable[bytes], keys: Sequence[str]
+) -> Iterator[Tuple[str, object]]:
+    """Yield `(key, value)` for every scalar value of one of `keys`, in document
+    order. Nesting is ignored, so the keys should be unique to the records of
+    interest (or their order should be enough to tell them apart)."""
+    pattern = re.compile(
+        rb'"('
+        + b"|".join(re.escape(key.encode()) for key in keys)
+        + rb')"\s*:\s*'
+        + _SCALAR
+    )
+
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        # A pair might be split across chunks, so only scan up to the last
+        # separator and keep the rest for the next chunk
+        end = max(buffer.rfind(b","), buffer.rfind(b"}"), buffer.rfind(b"]"))
+        if end < 0:
+            continue
+
+        for match in pattern.finditer(buffer, 0, end):
+            yield match.group(1).decode(), _decode(match.group(2))
+        buffer = buffer[end:]
+
+    for match in pattern.finditer(buffer):
+        yield match.group(1).decode(), _decode(match.group(2))
+
+
+def _decode(raw: bytes):
+    if raw[:1] == b'"' and b"\\" not in raw:
+        return raw[1:-1].decode()
+    return json.loads(raw)
+
+
+class ColumnBuffer:
+    """A preallocated array that is filled one value at a time. It grows if the
+    initial capacity turns out to be too small."""
+
+    def __init__(self, capacity: int, dtype=np.float64):
+        self._values = np.empty(max(capacity, 1), dtype=dtype)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, value) -> None:
+        if self._size == len(self._values):
+            grown = np.empty(2 * len(self._values), dtype=self._values.dtype)
+            grown[: self._size] = self._values
+            self._values = grown
+
+        self._values[self._size] = value
+        self._size += 1
+
+    def to_array(self) -> np.ndarray:
+        return self._values[: self._size]
@@ -0,0 +1,103 @@
+"""What-if simulation of moving flexible consumption to cheaper hours.
+
+The consumption and the price (spot price + tariff) are laid out as matrices
+with one row per day and one column per period of the day. For every period, a
+share of its consumption is moved to the cheapest period within the shift
+window on the same day. Without a limit on how much can be moved into one
+period, this is the cost-optimal redistribution, and it is computed for all
+days at once.
+"""
+
+from typing import List, NamedTuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class DayMatrices(NamedTuple):
+    days: pd.DatetimeIndex
+    # consumption and price with shape (days, periods per day)
+    load: np.ndarray
+    price: np.ndarray
+
+
+class LoadShiftResult(NamedTuple):
+    # cost per day before and after moving consumption, and the saving
+    daily: pd.DataFrame
+    # average consumption per period of the day before and after
+    profile: pd.DataFrame
+
+
+def build_day_matrices(
+    df: pd.DataFrame, columns: List[str], periods_per_day: int = 24
+) -> DayMatrices:
+    """Lay out the summed consumption of `columns` and the price per kWh of `df`
+    on a complete (days x periods) grid. Missing consumption is zero, missing
+    prices are NaN."""
+    df = df[~df.index.duplicated(keep="last")]
+    days = pd.date_range(df.index.min().floor("d"), df.index.max().floor("d"))
+    offsets = pd.timedelta_range(
+        0, periods=periods_per_day, freq=f"{1440 // periods_per_day}min"
+    )
+    grid = (days.values[:, None] + offsets.values[None, :]).ravel()
+
+    df = df.reindex(grid)
+    load = df[columns].sum(axis=1).to_numpy()
+    price = (df["SpotPrice"] + df["Tarif"]).to_numpy()
+
+    shape = (len(days), periods_per_day)
+    return DayMatrices(days, load.reshape(shape), price.reshape(shape))
+
+
+def simulate_load_shift(
+    matrices: DayMatrices, flexible_share: float, window: int
+) -> LoadShiftResult:
+    """Move `flexible_share` (0 to 1) of the consumption in every period to the
+    cheapest period at most `window` periods before or after it, on the same
+    day. Periods without a price are left as they are."""
+    load, price = matrices.load, matrices.price
+    n_days, n_periods = load.shape
+
+    priced = np.isfinite(price)
+    flexible = np.where(priced, load * flexible_share, 0.0)
+
+    # Cheapest period in the window around each period. Periods outside the day
+    # or without a price are padded with inf so they are never chosen.
+    padded = np.pad(
+        np.where(priced, price, np.inf),
+        ((0, 0), (window, window)),
+        constant_values=np.inf,
+    )
+    windows = sliding_window_view(padded, 2 * window + 1, axis=1)
+    best = windows.argmin(axis=2)
+    best_price = np.take_along_axis(windows, best[..., None], axis=2)[..., 0]
+    periods = np.arange(n_periods)[None, :]
+    target = np.where(priced, periods + best - window, periods)
+
+    cost = np.where(priced, load * price, 0.0).sum(axis=1)
+    shifted_cost = (
+        np.where(priced, (load - flexible) * price, 0.0)
+        + flexible * np.where(priced, best_price, 0.0)
+    ).sum(axis=1)
+
+    # Add the moved consumption to the periods it was moved to
+    flat_target = (np.arange(n_days)[:, None] * n_periods + target).ravel()
+    moved = np.bincount(
+        flat_target, weights=flexible.ravel(), minlength=n_days * n_periods
+    ).reshape(load.shape)
+    shifted_load = load - flexible + moved
+
+    daily = pd.DataFrame(
+        {
+            "Pris": cost,
+            "Pris efter flytning": shifted_cost,
+            "Besparelse": cost - shifted_cost,
+        },
+        index=matrices.days,
+    )
+    profile = pd.DataFrame(
+        {"Forbrug": load.mean(axis=0), "Flyttet forbrug": shifted_load.mean(axis=0)},
+        index=pd.Index(np.arange(n_periods) * 24 / n_periods, name="Timer"),
+    )
+    return LoadShiftResult(daily, profile)
@@ -0,0 +1,213 @@
+"""Optional offloading of aggregations and figures to a process pool.
+
+Streamlit runs every session in a thread of one process, so the pandas and
+plotly work of one session holds the GIL while the others wait. With the
+environment variable `ELOVERSIGT_WORKERS` set to a number of processes, that
+work runs in a pool of worker processes shared by all sessions instead.
+
+Large frames are passed to the workers through shared memory. The index and
+columns are copied once into a segment named after the content hash of the
+frame, and the workers read them from there without copying or unpickling.
+Without the variable, or with 0 workers, everything runs in the calling thread.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .fingerprint import fingerprint
+
+WORKERS_ENV = "ELOVERSIGT_WORKERS"
+# Frames kept in shared memory, the least recently used is released first
+MAX_SHARED_FRAMES = 16
+# Smaller frames are cheaper to pickle than to put in shared memory
+MIN_SHARED_ROWS = 10_000
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# Segments created by the server process, by fingerprint of the frame
+_segments: "OrderedDict[str, Tuple[SharedMemory, SharedFrame]]" = OrderedDict()
+_segments_lock = threading.Lock()
+
+# Segments attached in a worker process, by name
+_attached: "OrderedDict[str, Tuple[SharedMemory, pd.DataFrame]]" = OrderedDict()
+
+
+class SharedFrame(NamedTuple):
+    # A frame in a shared memory segment: the index as int64 nanoseconds,
+    # followed by the columns as float64, one after the other
+    name: str
+    columns: List[str]
+    rows: int
+    index_name: Optional[str]
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """The pool shared by all sessions of the server process, or None if
+    offloading is off. It is started on first use and shut down when the
+    process exits."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get(WORKERS_ENV) or 0)
+            if workers <= 0:
+                return None
+            # The server runs threads, which do not survive a fork
+            _pool = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            atexit.register(shutdown)
+        return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+    with _segments_lock:
+        while _segments:
+            _release(_segments.popitem()[1][0])
+
+
+def _reset_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        # Another session may have replaced the broken pool already
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run(func: Callable, df: pd.DataFrame, *args, **kwargs):
+    """`func(df, *args, **kwargs)` in the process pool, or in this thread if
+    offloading is off. `func` must be importable by the workers."""
+    pool = get_pool()
+    if pool is None:
+        return func(df, *args, **kwargs)
+
+    frame = share_frame(df) if can_share(df) else df
+    try:
+        return pool.submit(_call, func, frame, args, kwargs).result()
+    except FileNotFoundError:
+        # The segment was released before the worker got to it
+        return func(df, *args, **kwargs)
+    except BrokenProcessPool:
+        # A worker died, e.g. out of memory. The pool cannot be used again, so
+        # a new one is started on the next call.
+        _reset_pool(pool)
+        return func(df, *args, **kwargs)
+
+
+def run_figure(build: Callable, df: pd.DataFrame, *args, **kwargs):
+    """The figure from `build(df, *args, **kwargs)`, built in the process pool
+    and sent back as JSON, or built in this thread if offloading is off."""
+    if get_pool() is None:
+        return build(df, *args, **kwargs)
+
+    import json
+
+    import plotly.graph_objects as go
+
+    from .figures import figure_json
+
+    # The worker built the figure from validated objects already. Validating
+    # it again here would hold the GIL for about half the time of the build.
+    return go.Figure(
+        json.loads(run(figure_json, df, build, *args, **kwargs)), _validate=False
+    )
+
+
+def can_share(df: pd.DataFrame) -> bool:
+    return (
+        len(df) >= MIN_SHARED_ROWS
+        and isinstance(df.index, pd.DatetimeIndex)
+        and df.index.tz is None
+        and df.index.dtype == "datetime64[ns]"
+        and all(dtype == np.float64 for dtype in df.dtypes)
+    )
+
+
+def share_frame(df: pd.DataFrame) -> SharedFrame:
+    """Put `df` in shared memory, unless a frame with the same content is there
+    already."""
+    key = fingerprint(df)
+    with _segments_lock:
+        if key in _segments:
+            _segments.move_to_end(key)
+            return _segments[key][1]
+
+        rows, n_columns = df.shape
+        shm = SharedMemory(create=True, size=max(8 * rows * (n_columns + 1), 1))
+        index = np.ndarray(rows, np.int64, shm.buf)
+        index[:] = df.index.asi8
+        values = np.ndarray((n_columns, rows), np.float64, shm.buf, offset=8 * rows)
+        values[:] = df.to_numpy().T
+        # No views may be left on the buffer when the segment is closed
+        del index, values
+
+        shared = SharedFrame(shm.name, list(df.columns), rows, df.index.name)
+        _segments[key] = (shm, shared)
+        while len(_segments) > MAX_SHARED_FRAMES:
+            _release(_segments.popitem(last=False)[1][0])
+        return shared
+
+
+def attach_frame(shared: SharedFrame) -> pd.DataFrame:
+    """The frame in shared memory as a read-only frame on top of the segment."""
+    if shared.name in _attached:
+        _attached.move_to_end(shared.name)
+        return _attached[shared.name][1]
+
+    # The workers share the resource tracker of the server process, so the
+    # segment is only released by the server
+    shm = SharedMemory(name=shared.name)
+
+    rows, n_columns = shared.rows, len(shared.columns)
+    index = np.ndarray(rows, np.int64, shm.buf)
+    values = np.ndarray((n_columns, rows), np.float64, shm.buf, offset=8 * rows)
+    index.flags.writeable = False
+    values.flags.writeable = False
+    df = pd.DataFrame(
+        values.T,
+        index=pd.DatetimeIndex(
+            index.view("datetime64[ns]"), name=shared.index_name, copy=False
+        ),
+        columns=shared.columns,
+        copy=False,
+    )
+
+    _attached[shared.name] = (shm, df)
+    while len(_attached) > MAX_SHARED_FRAMES:
+        _close(_attached.popitem(last=False)[1][0])
+    return df
+
+
+def _call(func: Callable, frame, args, kwargs):
+    if isinstance(frame, SharedFrame):
+        frame = attach_frame(frame)
+    return func(frame, *args, **kwargs)
+
+
+def _close(shm: SharedMemory) -> None:
+    try:
+        shm.close()
+    except BufferError:
+        # A frame on the segment is still in use, it is closed when collected
+        pass
+
+
+def _release(shm: SharedMemory) -> None:
+    _close(shm)
+    shm.unlink()
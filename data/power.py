@@ -1,18 +1,30 @@
 import logging
-import datetime as dt
 import urllib
 import warnings
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import requests
 
+from .json_stream import CHUNK_SIZE, ColumnBuffer, iter_values
+from .resolution import Resolution, get_resolution, to_resolution
+
 BASE_URL_CUSTOMERAPI = "https://api.eloverblik.dk/CustomerApi/api/"
 BASE_URL_DATASET = "https://api.energidataservice.dk/dataset/"
+# Tariffs are published per hour (Price1 to Price24) and repeated over the
+# periods of each hour when the data has a finer resolution
+TARIF_RESOLUTION = "PT1H"
+# Spot prices are quarter-hourly from this date, before it they are hourly and
+# in another dataset
+QUARTER_HOUR_SPOT_PRICES_FROM = "2025-10-01"
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
 
 def get_data_access_token(refresh_token):
 
@@ -77,7 +89,7 @@ def get_userinfo_detailed(
     return result
 
 
-def get_tarif_prices(userinfo, date_to, date_from):
+def get_tarif_prices(userinfo, date_to, date_from, resolution: str = "PT1H"):
     charge_owner = userinfo["gridOperatorName"]
 
     url = BASE_URL_DATASET + "datahubpricelist"
@@ -87,7 +99,9 @@ def get_tarif_prices(userinfo, date_to, date_from):
         + f"end={date_to}&"
         + 'filter={"ChargeOwner":"'
         + charge_owner
-        + '", "ResolutionDuration": "PT1H"}&'
+        + '", "ResolutionDuration": "'
+        + TARIF_RESOLUTION
+        + '"}&'
         + "timezone=DK&"
         + "limit=1000"
     )
@@ -101,61 +115,100 @@ def get_tarif_prices(userinfo, date_to, date_from):
             headers={"Content-Type": "application/json"},
             verify=False,
             params=payload_str,
+            stream=True,
         )
     response.raise_for_status()
-    return parse_tarif_prices_response(response.json())
+    with response:
+        return parse_tarif_prices_stream(
+            response.iter_content(CHUNK_SIZE),
+            date_from=date_from,
+            date_to=date_to,
+            resolution=get_resolution(resolution),
+        )
+
 
+def parse_tarif_prices_stream(
+    chunks: Iterable[bytes], date_from, date_to, resolution: Resolution
+) -> pd.DataFrame:
+    price_keys = [f"Price{hour + 1}" for hour in range(24)]
+
+    # Charges with the same validity period are summed hour by hour
+    groups: Dict[Tuple[str, Optional[str]], np.ndarray] = {}
+    valid_from, valid_to, prices = None, None, None
+
+    def add_record():
+        if valid_from is not None:
+            key = (valid_from, valid_to)
+            groups[key] = groups.get(key, 0) + prices
+
+    for key, value in iter_values(chunks, ("ValidFrom", "ValidTo", *price_keys)):
+        if key == "ValidFrom":
+            add_record()
+            valid_from, valid_to, prices = value, None, np.zeros(24)
+        elif key == "ValidTo":
+            valid_to = value
+        elif value is not None:
+            prices[int(key[len("Price") :]) - 1] = value
+    add_record()
+
+    # Only expand the prices over the requested days
+    first_day = np.datetime64(str(date_from), "D")
+    end_day = np.datetime64(str(date_to), "D") + 1
+    offsets = (np.arange(resolution.periods_per_day) * resolution.minutes).astype(
+        "timedelta64[m]"
+    )
 
-def parse_tarif_prices_response(results: dict) -> pd.DataFrame:
-    records = results["records"]
-    df = pd.DataFrame(columns=["ValidFrom", "ValidTo", "Hour", "Tarif"])
+    datetimes, tarifs = [], []
+    for (valid_from, valid_to), prices in sorted(
+        groups.items(), key=lambda item: (item[0][0], item[0][1] or "")
+    ):
+        start = max(np.datetime64(valid_from[:10], "D"), first_day)
+        stop = end_day if valid_to is None else np.datetime64(valid_to[:10], "D")
+        days = np.arange(start, min(stop, end_day), dtype="datetime64[D]")
+
+        datetimes.append((days[:, None] + offsets[None, :]).ravel())
+        tarifs.append(
+            np.tile(np.repeat(prices, resolution.periods_per_hour), len(days))
+        )
 
-    fmt = r"%Y-%m-%dT%X"
-    to_datetime = lambda d: dt.datetime.strptime(d, fmt).date()
+    if not datetimes:
+        return pd.DataFrame({"Tarif": []}, index=pd.DatetimeIndex([]))
 
-    dates = pd.date_range(
-        to_datetime(records[0]["ValidFrom"]),
-        to_datetime(records[0]["ValidTo"]) - dt.timedelta(days=1),
-        freq="d",
+    return pd.DataFrame(
+        {"Tarif": np.concatenate(tarifs)},
+        index=pd.DatetimeIndex(np.concatenate(datetimes).astype("datetime64[ns]")),
     )
 
-    index = 0
-    for record in records:
-        for hour in range(24):
-            df2 = pd.DataFrame(
-                index=[index],
-                data={
-                    "ValidFrom": to_datetime(record["ValidFrom"]),
-                    "ValidTo": to_datetime(record["ValidTo"]),
-                    "Hour": dt.time(hour),
-                    "Tarif": record[f"Price{hour+1}"],
-                },
-            )
-            df = pd.concat([df, df2])
-            index += 1
-
-    prices = []
-    datetimes = []
-    valid_groups = df.groupby(["ValidFrom", "ValidTo"])
-    for group, idx in valid_groups.groups.items():
-        subset = df.iloc[idx].groupby("Hour")["Tarif"].sum()
-        dates = pd.date_range(
-            group[0],
-            group[1] - dt.timedelta(days=1),
-            freq="d",
+
+def get_spot_prices(
+    date_to, date_from, dk_west: bool = False, resolution: str = "PT1H"
+) -> pd.DataFrame:
+    """Spot prices in `resolution`. The period is split at the move to
+    quarter-hour prices, each part is fetched from its dataset and converted
+    to `resolution`, so hourly prices are repeated over the quarters."""
+    start, end = pd.Timestamp(str(date_from)), pd.Timestamp(str(date_to))
+    switch = pd.Timestamp(QUARTER_HOUR_SPOT_PRICES_FROM)
+
+    frames = []
+    if start < switch:
+        hourly = _get_spot_prices_from_dataset(
+            start.date(), min(end, switch).date(), dk_west, get_resolution("PT1H")
+        )
+        frames.append(to_resolution(hourly, resolution))
+    if end >= switch:
+        quarterly = _get_spot_prices_from_dataset(
+            max(start, switch).date(), end.date(), dk_west, get_resolution("PT15M")
         )
-        for date in dates:
-            for hour in range(24):
-                d = dt.datetime(date.year, date.month, date.day, hour)
-                datetimes.append(d)
-                prices.append(subset.iloc[hour])
+        frames.append(to_resolution(quarterly, resolution))
 
-    df_final = pd.DataFrame({"Tarif": prices}, index=datetimes)
-    return df_final
+    df = pd.concat(frames)
+    return df[~df.index.duplicated(keep="last")].sort_index()
 
 
-def get_spot_prices(date_to, date_from, dk_west: bool = False) -> pd.DataFrame:
-    url = BASE_URL_DATASET + "Elspotprices"
+def _get_spot_prices_from_dataset(
+    date_from, date_to, dk_west: bool, resolution: Resolution
+) -> pd.DataFrame:
+    url = BASE_URL_DATASET + resolution.spot_dataset
     area = "DK1" if dk_west else "DK2"
 
     params = (
@@ -164,7 +217,7 @@ def get_spot_prices(date_to, date_from, dk_west: bool = False) -> pd.DataFrame:
         + 'filter={"PriceArea":"'
         + area
         + '"}&'
-        + "columns=HourDK,SpotPriceDKK&"
+        + f"columns={resolution.spot_time_column},{resolution.spot_price_column}&"
         + "timezone=DK&"
         + "limit=0"
     )
@@ -178,21 +231,81 @@ def get_spot_prices(date_to, date_from, dk_west: bool = False) -> pd.DataFrame:
             headers={"Content-Type": "application/json"},
             verify=False,
             params=payload_str,
+            stream=True,
         )
     response.raise_for_status()
-    return parse_spot_prices_response(response.json())
+    with response:
+        return parse_spot_prices_stream(
+            response.iter_content(CHUNK_SIZE),
+            capacity=_expected_points(date_from, date_to, resolution),
+            resolution=resolution,
+        )
+
+
+def parse_spot_prices_stream(
+    chunks: Iterable[bytes], capacity: int, resolution: Resolution
+) -> pd.DataFrame:
+    datetimes = ColumnBuffer(capacity, dtype="datetime64[s]")
+    prices = ColumnBuffer(capacity)
+
+    time_column = resolution.spot_time_column
+    time, price = None, _MISSING
+    for key, value in iter_values(chunks, (time_column, resolution.spot_price_column)):
+        if key == time_column:
+            time = value
+        else:
+            price = np.nan if value is None else value / 1000
+
+        if time is not None and price is not _MISSING:
+            datetimes.append(np.datetime64(time))
+            prices.append(price)
+            time, price = None, _MISSING
+
+    return pd.DataFrame(
+        {"SpotPrice": prices.to_array()},
+        index=pd.DatetimeIndex(datetimes.to_array().astype("datetime64[ns]")),
+    )
+
 
+def parse_meterdata_stream(
+    chunks: Iterable[bytes], capacity: int, resolution: Resolution
+) -> pd.DataFrame:
+    # Each Period holds the points of one day. Its timeInterval comes before its
+    # points, so the latest "end" seen is the end of the current Period.
+    days = []
+    period = ColumnBuffer(capacity, dtype=np.int64)
+    positions = ColumnBuffer(capacity, dtype=np.int64)
+    quantities = ColumnBuffer(capacity)
+
+    position = 0
+    for key, value in iter_values(chunks, ("end", "position", "out_Quantity.quantity")):
+        if key == "end":
+            day = np.datetime64(value[:10], "D")
+        elif key == "position":
+            position = int(value)
+            if position == 1:
+                days.append(day)
+        else:
+            period.append(len(days) - 1)
+            positions.append(position)
+            quantities.append(float(value))
+
+    # Points beyond a normal day (the extra hour on DST days) are dropped
+    positions = positions.to_array()
+    mask = positions <= resolution.periods_per_day
+    times = np.array(days, dtype="datetime64[m]")[period.to_array()[mask]] + (
+        (positions[mask] - 1) * resolution.minutes
+    ).astype("timedelta64[m]")
+
+    return pd.DataFrame(
+        {"Elforbrug": quantities.to_array()[mask]},
+        index=pd.DatetimeIndex(times.astype("datetime64[ns]")),
+    )
 
-def parse_spot_prices_response(result: dict) -> pd.DataFrame:
-    fmt = r"%Y-%m-%dT%X"
-    datetimes = []
-    prices = []
-    for record in result["records"]:
-        datetimes.append(dt.datetime.strptime(record["HourDK"], fmt))
-        prices.append(record["SpotPriceDKK"] / 1000)
 
-    df_prices = pd.DataFrame({"SpotPrice": prices}, index=datetimes)
-    return df_prices
+def _expected_points(date_from, date_to, resolution: Resolution) -> int:
+    days = (pd.Timestamp(str(date_to)) - pd.Timestamp(str(date_from))).days + 1
+    return max(days, 1) * resolution.periods_per_day
 
 
 def get_power_usage(
@@ -200,7 +313,9 @@ def get_power_usage(
     date_to: str = str(datetime.now().date()),
     dk_west: bool = False,
     refresh_token: str = None,
+    resolution: str = "PT1H",
 ) -> pd.DataFrame:
+    meter_resolution = get_resolution(resolution)
 
     logger.info("Getting a data access token")
     data_access_token = get_data_access_token(refresh_token)
@@ -209,11 +324,9 @@ def get_power_usage(
     metering_point_id = get_meteringpoint_id(data_access_token)
 
     json_data = {"meteringPoints": {"meteringPoint": [f"{metering_point_id}"]}}
-    resolution = "Hour"  # "Hour" or "Day" or "Month"
-
     meter_data_url = (
         BASE_URL_CUSTOMERAPI
-        + f"meterdata/gettimeseries/{date_from}/{date_to}/{resolution}"
+        + f"meterdata/gettimeseries/{date_from}/{date_to}/{meter_resolution.meterdata}"
     )
     headers = {
         "Content-Type": "application/json",
@@ -224,41 +337,32 @@ def get_power_usage(
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         response = requests.post(
-            meter_data_url, json=json_data, headers=headers, verify=False
+            meter_data_url,
+            json=json_data,
+            headers=headers,
+            verify=False,
+            stream=True,
         )
     response.raise_for_status()
-    measurements = response.json().get("result")[0]
-
-    timeseries = measurements["MyEnergyData_MarketDocument"]["TimeSeries"][0]
-    period = timeseries["Period"]
-
-    fmt = r"%Y-%m-%dT%XZ"
-
-    dfs = []
-    for point in period:
-        quantities = [float(p["out_Quantity.quantity"]) for p in point["Point"]]
-        date = datetime.strptime(point["timeInterval"]["end"], fmt)
-        n_examples = min(24, len(quantities))
-        times = [
-            datetime(year=date.year, month=date.month, day=date.day, hour=i)
-            for i in range(n_examples)
-        ]
-        dfs.append(
-            pd.DataFrame(
-                {"Elforbrug": quantities[:n_examples]}, index=pd.DatetimeIndex(times)
-            )
+    with response:
+        df = parse_meterdata_stream(
+            response.iter_content(CHUNK_SIZE),
+            capacity=_expected_points(date_from, date_to, meter_resolution),
+            resolution=meter_resolution,
         )
-    df = pd.concat(dfs)
 
     logger.info("Getting prices")
     userinfo = get_userinfo_detailed(
         data_access_token=data_access_token, meteringpoint_id=metering_point_id
     )
-    tarif_df = get_tarif_prices(userinfo, date_to=date_to, date_from=date_from)
+    tarif_df = get_tarif_prices(
+        userinfo, date_to=date_to, date_from=date_from, resolution=resolution
+    )
     spotprice_df = get_spot_prices(
         date_to=date_to,
         date_from=date_from,
         dk_west=dk_west,
+        resolution=resolution,
     )
 
     df = pd.merge(df, tarif_df, "left", left_index=True, right_index=True)
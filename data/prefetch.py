@@ -0,0 +1,327 @@
+"""Background refresh of recent data for accounts that are in use.
+
+Accounts are registered when a user fetches data. A scheduler thread then
+refreshes their latest days on a fixed interval in a small thread pool and
+merges them into a shared in-process store, so the next page load is served
+from there instead of waiting on the APIs. Spot prices are also refreshed
+right after the next day's prices are published.
+"""
+
+import atexit
+import datetime as dt
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .power import get_power_usage, get_spot_prices
+from .smart_cloud import get_smartcloud_data
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 60 * 60
+# Accounts not used for this long are dropped along with their data
+ACCOUNT_TTL = 3 * 24 * 60 * 60
+# Hour at which the next day's spot prices are published
+SPOT_PRICE_PUBLISH_HOUR = 13
+
+_scheduler: Optional["PrefetchScheduler"] = None
+_scheduler_lock = threading.Lock()
+
+
+def account_key(*parts) -> str:
+    return hashlib.sha256("\0".join(map(str, parts)).encode()).hexdigest()
+
+
+def power_account_key(
+    refresh_token: str, dk_west: bool, resolution: str = "PT1H"
+) -> str:
+    return account_key("power", refresh_token, dk_west, resolution)
+
+
+def smartcloud_account_key(username: str, password: str) -> str:
+    return account_key("smartcloud", username, password)
+
+
+def spot_prices_key(dk_west: bool, resolution: str = "PT1H") -> str:
+    return account_key("spot", dk_west, resolution)
+
+
+@dataclass
+class _Job:
+    # fetches the data from `date_from` to `date_to`
+    fetch: Callable[[dt.date, dt.date], pd.DataFrame]
+    days_back: int
+    days_ahead: int = 0
+    publish_hour: Optional[int] = None
+    last_used: float = field(default_factory=time.monotonic)
+    last_refresh: Optional[dt.datetime] = None
+    running: Optional[Future] = None
+
+
+class PrefetchScheduler:
+    def __init__(
+        self,
+        max_workers: int = 2,
+        interval: float = REFRESH_INTERVAL,
+        refresh_days: int = 3,
+        store_dir: Optional[Path] = None,
+    ):
+        self.interval = interval
+        self.refresh_days = refresh_days
+        self.store_dir = store_dir
+
+        self._jobs: Dict[str, _Job] = {}
+        self._store: Dict[str, pd.DataFrame] = {}
+        # The periods of dates the store has all data for, by what was fetched
+        self._covered: Dict[str, List[Tuple[dt.date, dt.date]]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="prefetch-scheduler", daemon=True
+        )
+
+    def start(self) -> "PrefetchScheduler":
+        self._thread.start()
+        return self
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def register_power_account(
+        self,
+        refresh_token: str,
+        dk_west: bool,
+        resolution: str = "PT1H",
+        df: Optional[pd.DataFrame] = None,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> str:
+        """Keep the power usage of an eloverblik account warm. `df` is data the
+        user has just fetched from `date_from` to `date_to` and seeds the
+        store."""
+        key = power_account_key(refresh_token, dk_west, resolution)
+
+        def fetch(date_from, date_to):
+            return get_power_usage(
+                date_from=str(date_from),
+                date_to=str(date_to),
+                dk_west=dk_west,
+                refresh_token=refresh_token,
+                resolution=resolution,
+            )
+
+        job = _Job(fetch, days_back=self.refresh_days)
+        return self._register(key, job, df, date_from, date_to)
+
+    def register_smartcloud_account(
+        self,
+        username: str,
+        password: str,
+        df: Optional[pd.DataFrame] = None,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> str:
+        key = smartcloud_account_key(username, password)
+
+        def fetch(date_from, date_to):
+            return get_smartcloud_data(
+                username=username,
+                password=password,
+                date_from=str(date_from),
+                date_to=str(date_to),
+            )
+
+        job = _Job(fetch, days_back=self.refresh_days)
+        return self._register(key, job, df, date_from, date_to)
+
+    def register_spot_prices(
+        self,
+        dk_west: bool,
+        resolution: str = "PT1H",
+        df: Optional[pd.DataFrame] = None,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> str:
+        """Keep the spot prices of the area warm, including the next day's."""
+        key = spot_prices_key(dk_west, resolution)
+
+        def fetch(date_from, date_to):
+            return get_spot_prices(
+                date_to=date_to,
+                date_from=date_from,
+                dk_west=dk_west,
+                resolution=resolution,
+            )
+
+        job = _Job(
+            fetch,
+            days_back=self.refresh_days,
+            days_ahead=2,
+            publish_hour=SPOT_PRICE_PUBLISH_HOUR,
+        )
+        return self._register(key, job, df, date_from, date_to)
+
+    def lookup(
+        self, key: str, date_from: dt.date, date_to: dt.date
+    ) -> Optional[pd.DataFrame]:
+        """The warm data of an account from `date_from` to `date_to`, or None if
+        the store does not cover all of it. Looking up does not register the
+        account, but keeps a registered one in use."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                job.last_used = time.monotonic()
+            df = self._store.get(key)
+            covered = self._covered.get(key, [])
+
+        if df is None or not any(
+            start <= date_from and date_to <= end for start, end in covered
+        ):
+            return None
+        start = dt.datetime.combine(date_from, dt.time())
+        end = dt.datetime.combine(date_to, dt.time()) + dt.timedelta(days=1)
+        return df[(df.index >= start) & (df.index < end)]
+
+    def _register(
+        self,
+        key: str,
+        job: _Job,
+        df: Optional[pd.DataFrame] = None,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> str:
+        with self._lock:
+            if key in self._jobs:
+                self._jobs[key].last_used = time.monotonic()
+            else:
+                # The user fetches the data now, so it is due after an interval
+                job.last_refresh = dt.datetime.now()
+                self._jobs[key] = job
+                if key not in self._store:
+                    self._store.update(self._load(key))
+
+        if df is not None:
+            self._merge(key, df, date_from, date_to)
+        return key
+
+    def _run(self) -> None:
+        # Check for due jobs often enough to catch the publishing of spot prices
+        while not self._stop.wait(min(self.interval, 5 * 60)):
+            self._drop_unused()
+            now = dt.datetime.now()
+            with self._lock:
+                due = [
+                    (key, job)
+                    for key, job in self._jobs.items()
+                    if (job.running is None or job.running.done())
+                    and self._is_due(job, now)
+                ]
+            for key, job in due:
+                if self._stop.is_set():
+                    return
+                job.running = self._executor.submit(self._refresh, key, job)
+
+    def _is_due(self, job: _Job, now: dt.datetime) -> bool:
+        if job.last_refresh is None:
+            return True
+        if (now - job.last_refresh).total_seconds() >= self.interval:
+            return True
+        if job.publish_hour is None:
+            return False
+        published = now.replace(hour=job.publish_hour, minute=0, second=0)
+        return job.last_refresh < published <= now
+
+    def _refresh(self, key: str, job: _Job) -> None:
+        today = dt.date.today()
+        started = dt.datetime.now()
+        date_from = today - dt.timedelta(days=job.days_back)
+        date_to = today + dt.timedelta(days=job.days_ahead)
+        try:
+            df = job.fetch(date_from, date_to)
+        except Exception:
+            # Try again at the next interval, the scheduler should not die
+            logger.exception("Prefetch failed")
+            df = None
+        job.last_refresh = started
+
+        if df is not None and not df.empty:
+            self._merge(key, df, date_from, date_to)
+
+    def _merge(
+        self,
+        key: str,
+        df: pd.DataFrame,
+        date_from: Optional[dt.date] = None,
+        date_to: Optional[dt.date] = None,
+    ) -> None:
+        with self._lock:
+            current = self._store.get(key)
+            if current is not None:
+                df = pd.concat([current, df])
+                df = df[~df.index.duplicated(keep="last")].sort_index()
+            self._store[key] = df
+            if date_from is not None and date_to is not None:
+                self._cover(key, date_from, date_to)
+        self._save(key, df)
+
+    def _cover(self, key: str, date_from: dt.date, date_to: dt.date) -> None:
+        # Periods that overlap or meet the fetched one are joined with it
+        one_day = dt.timedelta(days=1)
+        covered = []
+        for start, end in self._covered.get(key, []):
+            if start <= date_to + one_day and date_from <= end + one_day:
+                date_from, date_to = min(date_from, start), max(date_to, end)
+            else:
+                covered.append((start, end))
+        self._covered[key] = sorted([*covered, (date_from, date_to)])
+
+    def _drop_unused(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key in [
+                key
+                for key, job in self._jobs.items()
+                if now - job.last_used > ACCOUNT_TTL
+            ]:
+                del self._jobs[key]
+                self._store.pop(key, None)
+                self._covered.pop(key, None)
+
+    def _path(self, key: str) -> Optional[Path]:
+        return None if self.store_dir is None else self.store_dir / f"{key}.csv"
+
+    def _save(self, key: str, df: pd.DataFrame) -> None:
+        path = self._path(key)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            df.to_csv(path)
+
+    def _load(self, key: str) -> Dict[str, pd.DataFrame]:
+        path = self._path(key)
+        if path is None or not path.exists():
+            return {}
+        return {key: pd.read_csv(path, parse_dates=True, index_col=[0])}
+
+
+def get_scheduler() -> PrefetchScheduler:
+    """The scheduler shared by all sessions of the server process. It is started
+    on first use and shut down when the process exits."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PrefetchScheduler().start()
+            atexit.register(_scheduler.shutdown, wait=False)
+        return _scheduler
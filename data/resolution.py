@@ -0,0 +1,108 @@
+"""Time resolutions of the data and conversion between them.
+
+Resolutions are named by their ISO 8601 duration like in the datahub, i.e.
+"PT1H" for hourly and "PT15M" for quarter-hourly data.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# Columns holding an amount per period, which are summed when periods are
+# merged and split when they are divided. Everything else (prices and
+# temperatures) is a level and is averaged or repeated.
+ENERGY_COLUMNS = ("Elforbrug", "Forbrug", "Varmepumpe", "Ren el", "totalforbrug")
+
+
+class Resolution(NamedTuple):
+    minutes: int
+    # aggregation used by the eloverblik timeseries endpoint
+    meterdata: str
+    # dataset on energidataservice.dk with the spot prices, and its columns
+    spot_dataset: str
+    spot_time_column: str
+    spot_price_column: str
+
+    @property
+    def freq(self) -> str:
+        return f"{self.minutes}min"
+
+    @property
+    def periods_per_hour(self) -> int:
+        return 60 // self.minutes
+
+    @property
+    def periods_per_day(self) -> int:
+        return 24 * self.periods_per_hour
+
+
+RESOLUTIONS = {
+    "PT1H": Resolution(
+        minutes=60,
+        meterdata="Hour",
+        spot_dataset="Elspotprices",
+        spot_time_column="HourDK",
+        spot_price_column="SpotPriceDKK",
+    ),
+    "PT15M": Resolution(
+        minutes=15,
+        meterdata="Quarter",
+        spot_dataset="DayAheadPrices",
+        spot_time_column="TimeDK",
+        spot_price_column="DayAheadPriceDKK",
+    ),
+}
+
+
+def get_resolution(name: str) -> Resolution:
+    if name not in RESOLUTIONS:
+        raise ValueError(
+            f"Ukendt tidsopløsning {name}, vælg en af {', '.join(RESOLUTIONS)}"
+        )
+    return RESOLUTIONS[name]
+
+
+def infer_resolution(df: pd.DataFrame) -> str:
+    """Name of the finest resolution matching the typical spacing of the index."""
+    if len(df.index) < 2:
+        return "PT1H"
+
+    steps = np.diff(df.index.values[:1000]).astype("timedelta64[m]").astype(np.int64)
+    step = np.median(np.abs(steps[steps != 0])) if steps.any() else 60
+    for name, resolution in sorted(RESOLUTIONS.items(), key=lambda x: x[1].minutes):
+        if step <= resolution.minutes:
+            return name
+    return "PT1H"
+
+
+def to_resolution(df: pd.DataFrame, resolution: str) -> pd.DataFrame:
+    """Convert `df` to `resolution`. Coarser data is split evenly across the
+    finer periods, finer data is summed (energy) or averaged (levels)."""
+    current = get_resolution(infer_resolution(df))
+    target = get_resolution(resolution)
+
+    if current.minutes == target.minutes:
+        return df
+
+    if current.minutes > target.minutes:
+        return _split_periods(df, current.minutes // target.minutes, target)
+
+    aggregations = {
+        column: "sum" if column in ENERGY_COLUMNS else "mean" for column in df.columns
+    }
+    return df.groupby(df.index.floor(target.freq)).agg(aggregations)
+
+
+def _split_periods(df: pd.DataFrame, n: int, target: Resolution) -> pd.DataFrame:
+    offsets = (np.arange(n) * target.minutes).astype("timedelta64[m]")
+    index = (
+        (df.index.values[:, None] + offsets[None, :]).ravel().astype("datetime64[ns]")
+    )
+
+    columns = {}
+    for column in df.columns:
+        values = np.repeat(df[column].to_numpy(), n)
+        columns[column] = values / n if column in ENERGY_COLUMNS else values
+
+    return pd.DataFrame(columns, index=pd.DatetimeIndex(index, name=df.index.name))
@@ -1,10 +1,17 @@
+import hashlib
+import threading
+import time
 import urllib
 import warnings
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, NamedTuple
 
 import pandas as pd
 import requests
+from requests.cookies import RequestsCookieJar
+
+from .resolution import RESOLUTIONS
 
 AQUAREA_SERVICE_BASE = "https://aquarea-smart.panasonic.com/"
 AQUAREA_SERVICE_LOGIN = "remote/v1/api/auth/login"
@@ -23,6 +30,17 @@ _HEADERS = {
 by_month = False
 outputfile = Path("varmepumpedata.csv")
 
+# Logged in sessions per account, keyed by a hash of the credentials, so
+# repeated fetches go straight to the consumption requests
+SESSION_TTL = 30 * 60
+_SESSIONS: Dict[str, "AquareaSession"] = {}
+_ACCOUNT_LOCKS: Dict[str, threading.Lock] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class AquareaError(Exception):
+    pass
+
 
 def aquarea_request(
     method: str,
@@ -52,8 +70,10 @@ def aquarea_request(
         data = response.json()
 
         if data["errorCode"] != 0:
-            raise Exception(
-                (f'{d["errorCode"]}: {d["errorMessage"]}' for d in data["message"])
+            raise AquareaError(
+                "; ".join(
+                    f'{d["errorCode"]}: {d["errorMessage"]}' for d in data["message"]
+                )
             )
 
     return response
@@ -80,34 +100,49 @@ def get_heat_data(data_cfg: dict, date: datetime) -> pd.DataFrame:
             elif subset["name"] == usage:
                 usage_data = subset["values"]
 
-    times = [
-        datetime(year=date.year, month=date.month, day=date.day, hour=i)
-        for i in range(24)
-    ]
+    # The number of values tells the resolution, e.g. 24 for hourly data. Days
+    # with a DST change have one hour more or less, so the nearest is used.
+    n_values = len(usage_data) or len(temp_data) or 24
+    resolution = min(
+        RESOLUTIONS.values(), key=lambda r: abs(r.periods_per_day - n_values)
+    )
+    # Values beyond a normal day (the extra hour on DST days) are dropped
+    n_values = min(n_values, resolution.periods_per_day)
+    times = pd.date_range(
+        datetime(year=date.year, month=date.month, day=date.day),
+        periods=n_values,
+        freq=resolution.freq,
+    )
     df = pd.DataFrame(
-        {"Temperatur": temp_data, "Forbrug": usage_data}, index=pd.DatetimeIndex(times)
+        {
+            "Temperatur": temp_data[:n_values] or None,
+            "Forbrug": usage_data[:n_values] or None,
+        },
+        index=times,
     )
 
     return df
 
 
-def get_smartcloud_data(
-    username: str,
-    password: str,
-    date_from: str = "2022-01-01",
-    date_to: str = pd.Timestamp.now().date(),
-) -> pd.DataFrame:
+class AquareaSession(NamedTuple):
+    cookies: RequestsCookieJar
+    device_guid: str
+    device_id: str
+    created: float
+
+
+def _account_key(username: str, password: str) -> str:
+    return hashlib.sha256(f"{username}\0{password}".encode()).hexdigest()
+
+
+def login(username: str, password: str) -> AquareaSession:
+    """Log in and look up the device, which takes three requests."""
     params = {
         "var.inputOmit": "false",
         "var.loginId": username,
         "var.password": password,
     }
 
-    headers = _HEADERS.copy()
-    headers["referer"] = AQUAREA_SERVICE_BASE
-
-    data = urllib.parse.urlencode(params)
-
     # login
     response = aquarea_request(
         "post",
@@ -139,24 +174,75 @@ def get_smartcloud_data(
     )
     device_id = response.cookies.get("selectedDeviceId")
 
+    return AquareaSession(cookie, device_guid, device_id, time.monotonic())
+
+
+def get_session(username: str, password: str, refresh: bool = False) -> AquareaSession:
+    """The cached session of the account, logging in if there is none, it has
+    expired or `refresh` is set."""
+    key = _account_key(username, password)
+    with _SESSIONS_LOCK:
+        lock = _ACCOUNT_LOCKS.setdefault(key, threading.Lock())
+
+    # Only one login per account at a time, other accounts are not blocked
+    with lock:
+        session = _SESSIONS.get(key)
+        if (
+            refresh
+            or session is None
+            or time.monotonic() - session.created > SESSION_TTL
+        ):
+            session = login(username, password)
+            _SESSIONS[key] = session
+    return session
+
+
+def get_consumption(session: AquareaSession, date: pd.Timestamp) -> dict:
+    c_cookie = session.cookies.copy()
+    c_cookie["selectedDeviceId"] = session.device_id
+    c_cookie["selectedGwid"] = session.device_guid
+    request_date = str(date.date())
+    response = aquarea_request(
+        "get",
+        f"{AQUAREA_SERVICE_CONSUMPTION}/{session.device_id}?date={request_date}",
+        verify=False,
+        cookies=c_cookie,
+        referer="https://aquarea-smart.panasonic.com/remote/a2wEnergyConsumption",
+        content_type="application/json",
+    )
+    return response.json()
+
+
+def _is_auth_error(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in (401, 403)
+    # An expired session gets an error code, or the login page instead of JSON
+    return isinstance(error, (AquareaError, ValueError))
+
+
+def get_smartcloud_data(
+    username: str,
+    password: str,
+    date_from: str = "2022-01-01",
+    date_to: str = pd.Timestamp.now().date(),
+) -> pd.DataFrame:
+    session = get_session(username, password)
+
     # get consumption
     dates = pd.date_range(date_from, date_to, freq="D")
     dataframes = []
 
+    relogged = False
     for date in dates:
-        c_cookie = cookie.copy()
-        c_cookie["selectedDeviceId"] = device_id
-        c_cookie["selectedGwid"] = device_guid
-        request_date = str(date.date())
-        response = aquarea_request(
-            "get",
-            f"{AQUAREA_SERVICE_CONSUMPTION}/{device_id}?date={request_date}",
-            verify=False,
-            cookies=c_cookie,
-            referer="https://aquarea-smart.panasonic.com/remote/a2wEnergyConsumption",
-            content_type="application/json",
-        )
-        data = response.json()
+        try:
+            data = get_consumption(session, date)
+        except (requests.HTTPError, AquareaError, ValueError) as error:
+            # The cached session might have expired, so log in again once
+            if relogged or not _is_auth_error(error):
+                raise
+            session = get_session(username, password, refresh=True)
+            relogged = True
+            data = get_consumption(session, date)
         dataframes.append(get_heat_data(data, date))
 
     return pd.concat(dataframes)
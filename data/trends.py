@@ -0,0 +1,133 @@
+"""Rolling trendlines and year-over-year comparison.
+
+The daily totals are computed once, and the rolling means for all windows
+come from a single cumulative sum. Every series is also laid out by year and
+day of year, and the hourly data by year and hour of the week, so switching
+years or windows in the app is only indexing into these arrays.
+"""
+
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .forecast import HOURS_PER_WEEK, hour_of_week
+from .resolution import to_resolution
+
+TREND_WINDOWS = (7, 30, 365)
+DAYS_PER_YEAR = 366
+
+
+class TrendArrays(NamedTuple):
+    columns: List[str]
+    # every day from the first to the last day of data
+    days: pd.DatetimeIndex
+    # daily totals and rolling means, each with shape (days, columns)
+    daily: np.ndarray
+    rolling: Dict[int, np.ndarray]
+    years: np.ndarray
+    # daily totals (window 1) and rolling means by year and day of year, each
+    # with shape (years, 366, columns)
+    day_of_year: Dict[int, np.ndarray]
+    # average consumption per hour of the week, shape (years, 168, columns)
+    hour_of_week: np.ndarray
+
+
+def day_of_year(index: pd.DatetimeIndex) -> np.ndarray:
+    """Zero-based day of year where March 1st is day 60 in every year, so the
+    same date lines up across leap and non-leap years."""
+    days = index.dayofyear.to_numpy() - 1
+    return days + ((~index.is_leap_year) & (index.month > 2)).astype(int)
+
+
+def build_trend_arrays(
+    df: pd.DataFrame, columns: List[str], windows=TREND_WINDOWS
+) -> TrendArrays:
+    df = to_resolution(df[columns], "PT1H")
+
+    # Daily totals on a complete day range, NaN on days without data
+    grouped = df.groupby(df.index.floor("d"))
+    days = pd.date_range(df.index.min().floor("d"), df.index.max().floor("d"))
+    daily = grouped.sum(min_count=1).reindex(days).to_numpy(dtype=float)
+
+    # Rolling means over the days with data in each window
+    has_data = np.isfinite(daily)
+    sums = np.vstack(
+        [np.zeros((1, len(columns))), np.cumsum(np.where(has_data, daily, 0), axis=0)]
+    )
+    counts = np.vstack([np.zeros((1, len(columns))), np.cumsum(has_data, axis=0)])
+    rolling = {}
+    for window in windows:
+        start = np.maximum(np.arange(1, len(days) + 1) - window, 0)
+        n = counts[1:] - counts[start]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rolling[window] = np.where(
+                n >= window / 2, (sums[1:] - sums[start]) / n, np.nan
+            )
+
+    years, year_codes = np.unique(days.year, return_inverse=True)
+    aligned_shape = (len(years), DAYS_PER_YEAR, len(columns))
+    flat_days = year_codes * DAYS_PER_YEAR + day_of_year(days)
+    aligned = {}
+    for window, values in [(1, daily), *rolling.items()]:
+        aligned[window] = np.full(aligned_shape, np.nan)
+        aligned[window].reshape(-1, len(columns))[flat_days] = values
+
+    # Average per hour of the week, computed on the hourly data in one pass
+    hour_codes = np.searchsorted(years, df.index.year) * HOURS_PER_WEEK + hour_of_week(
+        df.index
+    )
+    n_bins = len(years) * HOURS_PER_WEEK
+    profile = np.empty((n_bins, len(columns)))
+    for i, column in enumerate(columns):
+        values = df[column].to_numpy(dtype=float)
+        finite = np.isfinite(values)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            profile[:, i] = np.bincount(
+                hour_codes[finite], weights=values[finite], minlength=n_bins
+            ) / np.bincount(hour_codes[finite], minlength=n_bins)
+
+    return TrendArrays(
+        columns=list(columns),
+        days=days,
+        daily=daily,
+        rolling=rolling,
+        years=years,
+        day_of_year=aligned,
+        hour_of_week=profile.reshape(len(years), HOURS_PER_WEEK, len(columns)),
+    )
+
+
+def trend_frame(arrays: TrendArrays, column: str, year: int, windows) -> pd.DataFrame:
+    """Daily totals and the chosen rolling means of `column` in `year`."""
+    i = arrays.columns.index(column)
+    mask = arrays.days.year == year
+    data = {"Dagligt forbrug": arrays.daily[mask, i]}
+    for window in windows:
+        data[f"{window} dages gennemsnit"] = arrays.rolling[window][mask, i]
+    return pd.DataFrame(data, index=arrays.days[mask])
+
+
+def year_over_year_frame(
+    arrays: TrendArrays, column: str, years, window: int = 1
+) -> pd.DataFrame:
+    """One column per year with the daily totals (`window` 1) or a rolling mean
+    of `column`, lined up by day of year."""
+    i = arrays.columns.index(column)
+    rows = np.searchsorted(arrays.years, years)
+    return pd.DataFrame(
+        arrays.day_of_year[window][rows, :, i].T,
+        columns=[str(year) for year in years],
+        index=pd.Index(np.arange(1, DAYS_PER_YEAR + 1), name="Dag på året"),
+    )
+
+
+def hour_of_week_frame(arrays: TrendArrays, column: str, years) -> pd.DataFrame:
+    """One column per year with the average of `column` per hour of the week."""
+    i = arrays.columns.index(column)
+    rows = np.searchsorted(arrays.years, years)
+    return pd.DataFrame(
+        arrays.hour_of_week[rows, :, i].T,
+        columns=[str(year) for year in years],
+        index=pd.Index(np.arange(HOURS_PER_WEEK), name="Time på ugen"),
+    )
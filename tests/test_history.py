@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+from data.history import read_history
+
+
+def test_csv_with_empty_column():
+    # Like the CSV download from the app, for a heat pump without temperatures
+    index = pd.date_range("2024-01-01", periods=24, freq="h")
+    df = pd.DataFrame(
+        {"Elforbrug": np.arange(24.0), "Temperatur": np.nan, "Forbrug": 1.0},
+        index=index,
+    )
+
+    history = read_history(df.to_csv().encode())
+
+    assert (history.dtypes == np.float64).all()
+    assert history["Temperatur"].isna().all()
+    pd.testing.assert_frame_equal(history, df, check_freq=False)